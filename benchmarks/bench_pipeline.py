@@ -0,0 +1,165 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# The benchmark times model loading itself and must never be answered from the result cache
+os.environ["BLAGHK_PRELOAD"] = "0"
+os.environ.pop("BLAGHK_CACHE_PATH", None)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from audio_ingest import AudioUpload, audio_duration, list_audio_files, load_audio
+from blaghk import MODEL_VERSION, PROFILE, models, run_pipeline
+from metrics import peak_rss
+from corpus import build_corpus
+
+PERCENTILES = [50, 90, 99]
+# Stage timings below this many seconds are too noisy to gate on
+MIN_SECONDS = 0.05
+
+
+# Function to read a recording the way the uploader in blaghk.py hands it over
+def read_upload(path):
+    with open(path, "rb") as f:
+        return AudioUpload(f.read(), os.path.splitext(path)[1][1:])
+
+
+# Function to load every model and time each one; they load in parallel, as in the app
+def load_models():
+    start = time.perf_counter()
+    models.start()
+    for name in models.loaders:
+        models.get(name)
+    return {"total": time.perf_counter() - start, **models.load_times}
+
+
+# Function to summarize a list of seconds
+def summarize(seconds):
+    seconds = np.asarray(seconds)
+    summary = {f"p{p}": float(np.percentile(seconds, p)) for p in PERCENTILES}
+    summary["mean"] = float(seconds.mean())
+    summary["count"] = len(seconds)
+    return summary
+
+
+# Function to run every recording one after the other and collect the timings of every stage
+def measure_latency(uploads, durations, repeats):
+    stages = {}
+    real_time_factors = []
+    for _ in range(repeats):
+        for upload, duration in zip(uploads, durations):
+            result = run_pipeline(upload)
+            for stage, seconds in result["timings"].items():
+                stages.setdefault(stage, []).append(seconds)
+            real_time_factors.append(result["timings"]["total"] / duration)
+    return {stage: summarize(seconds) for stage, seconds in stages.items()}, summarize(real_time_factors)
+
+
+# Function to run every recording from several callers at once and measure how much gets through
+def measure_throughput(uploads, durations, concurrency, repeats):
+    work = uploads * repeats
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(run_pipeline, work))
+    elapsed = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "calls_per_second": len(work) / elapsed,
+        "audio_seconds_per_second": sum(durations) * repeats / elapsed,
+    }
+
+
+def run_benchmark(paths, repeats=3, concurrency=4):
+    uploads = [read_upload(path) for path in paths]
+    durations = [audio_duration(load_audio(upload)) for upload in uploads]
+    model_load = load_models()
+
+    # The first call pays for lazy initialization, e.g. ffmpeg and torch kernels
+    run_pipeline(uploads[0])
+
+    stages, real_time_factor = measure_latency(uploads, durations, repeats)
+    throughput = measure_throughput(uploads, durations, concurrency, repeats)
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "profile": PROFILE,
+            "model_version": MODEL_VERSION,
+        },
+        "corpus": {"files": len(paths), "audio_seconds": sum(durations)},
+        "model_load": model_load,
+        "stages": stages,
+        "real_time_factor": real_time_factor,
+        "throughput": throughput,
+        "peak_rss": peak_rss(),
+    }
+
+
+# Function to list every number that got worse than the baseline by more than the tolerance
+def find_regressions(result, baseline, tolerance):
+    checks = [(f"model_load.{name}", baseline["model_load"][name], result["model_load"].get(name), False)
+              for name in baseline["model_load"]]
+    for stage, summary in baseline["stages"].items():
+        for p in PERCENTILES[:2]:
+            checks.append((f"stages.{stage}.p{p}", summary[f"p{p}"],
+                           result["stages"].get(stage, {}).get(f"p{p}"), False))
+    checks.append(("throughput.calls_per_second", baseline["throughput"]["calls_per_second"],
+                   result["throughput"]["calls_per_second"], True))
+    checks.append(("peak_rss", baseline["peak_rss"], result["peak_rss"], False))
+
+    regressions = []
+    for name, before, after, higher_is_better in checks:
+        if after is None:
+            continue
+        if higher_is_better:
+            regressed = after < before * (1 - tolerance)
+        else:
+            regressed = after > before * (1 + tolerance) and (name == "peak_rss" or after - before > MIN_SECONDS)
+        if regressed:
+            regressions.append(f"{name}: {before:.4g} -> {after:.4g}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the triage pipeline and compare against a baseline.")
+    parser.add_argument("--corpus", default="benchmarks/corpus",
+                        help="directory of recordings; the synthetic corpus is generated there if it is empty")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=4, help="simultaneous calls in the throughput run")
+    parser.add_argument("--output", default="benchmarks/results.json")
+    parser.add_argument("--baseline", help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", help="also write the results to this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.corpus) or not list_audio_files(args.corpus):
+        build_corpus(args.corpus)
+    paths = list_audio_files(args.corpus)
+    result = run_benchmark(paths, args.repeats, args.concurrency)
+
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, "w") as f:
+            json.dump(result, f, indent=2)
+    print(json.dumps({stage: round(summary["p50"], 3) for stage, summary in result["stages"].items()}),
+          file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["environment"] != result["environment"]:
+            print(f"warning: baseline was measured on {baseline['environment']}", file=sys.stderr)
+        regressions = find_regressions(result, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
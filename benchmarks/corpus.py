@@ -0,0 +1,79 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+# Every format the uploader in blaghk.py accepts
+FORMATS = ["wav", "mp3", "m4a", "mp4"]
+# Seconds, from a short hang-up to a long call
+LENGTHS = [5, 15, 60, 180]
+CODECS = {"wav": ["-c:a", "pcm_s16le"], "mp3": ["-c:a", "libmp3lame", "-b:a", "64k"],
+          "m4a": ["-c:a", "aac", "-b:a", "64k"], "mp4": ["-c:a", "aac", "-b:a", "64k"]}
+
+
+# Function to synthesize a call: voiced bursts at a syllable rate, pauses between phrases and line noise
+def synthetic_call(seconds, seed, sample_rate=SAMPLE_RATE):
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sample_rate)
+    audio = rng.normal(0, 0.003, n).astype(np.float32)
+    position = int(rng.uniform(0.3, 1.0) * sample_rate)
+    while position < n:
+        phrase = int(rng.uniform(1.0, 4.0) * sample_rate)
+        t = np.arange(min(phrase, n - position)) / sample_rate
+        pitch = rng.uniform(100, 250) * (1 + 0.1 * np.sin(2 * np.pi * 0.5 * t))
+        phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+        voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+        envelope = np.clip(np.sin(2 * np.pi * rng.uniform(3, 6) * t), 0, None)
+        audio[position:position + len(t)] += (0.1 * voiced * envelope).astype(np.float32)
+        position += phrase + int(rng.uniform(0.3, 2.0) * sample_rate)
+    return np.clip(audio, -1, 1)
+
+
+# Function to encode a buffer with ffmpeg into the format of the file name
+def encode(audio, path, sample_rate=SAMPLE_RATE):
+    file_format = os.path.splitext(path)[1][1:]
+    command = ["ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-f", "f32le", "-ar", str(sample_rate), "-ac", "1",
+               "-i", "pipe:0", *CODECS[file_format], path]
+    subprocess.run(command, input=audio.tobytes(), check=True)
+
+
+# Function to write the corpus once; the same seed always gives the same recordings
+def build_corpus(directory, lengths=LENGTHS, formats=FORMATS, seed=0):
+    manifest_path = os.path.join(directory, "corpus.json")
+    config = {"lengths": lengths, "formats": formats, "seed": seed}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest["config"] == config:
+            return manifest
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    for i, seconds in enumerate(lengths):
+        audio = synthetic_call(seconds, seed + i)
+        for file_format in formats:
+            path = os.path.join(directory, f"call_{seconds:04d}s.{file_format}")
+            encode(audio, path)
+            files.append({"path": path, "format": file_format, "duration": seconds})
+    manifest = {"config": config, "files": files}
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the synthetic call corpus of the benchmarks.")
+    parser.add_argument("-o", "--output", default="benchmarks/corpus")
+    parser.add_argument("--lengths", nargs="+", type=int, default=LENGTHS, help="seconds")
+    parser.add_argument("--formats", nargs="+", default=FORMATS, choices=FORMATS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    manifest = build_corpus(args.output, args.lengths, args.formats, args.seed)
+    print(f"{len(manifest['files'])} recordings in {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
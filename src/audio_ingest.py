@@ -0,0 +1,108 @@
+import os
+import glob
+import hashlib
+import tempfile
+import subprocess
+import numpy as np
+
+# Whisper and the wav2vec emotion model both expect 16 kHz mono audio
+SAMPLE_RATE = 16000
+# The formats the uploader in blaghk.py accepts
+AUDIO_EXTENSIONS = (".mp3", ".mp4", ".wav", ".m4a")
+
+
+# In-memory handle of one recording, named after its content
+class AudioUpload:
+    def __init__(self, audio_bytes, file_extension):
+        self.audio_bytes = audio_bytes
+        self.file_extension = file_extension
+        self.content_hash = hashlib.sha256(audio_bytes).hexdigest()
+
+    @property
+    def file_name(self):
+        return f"audio_{self.content_hash[:16]}.{self.file_extension}"
+
+    @property
+    def stem(self):
+        return self.file_name.rsplit(".", 1)[0]
+
+
+# Function to run ffmpeg once and turn its 16-bit PCM output into a float32 buffer
+def run_ffmpeg(input_arg, input_bytes=None, sample_rate=SAMPLE_RATE):
+    cmd = [
+        "ffmpeg",
+        "-threads", "0",
+        "-i", input_arg,
+        "-f", "s16le",
+        "-ac", "1",
+        "-acodec", "pcm_s16le",
+        "-ar", str(sample_rate),
+        "-",
+    ]
+    if input_bytes is None:
+        cmd.insert(1, "-nostdin")
+    out = subprocess.run(cmd, input=input_bytes, capture_output=True, check=True).stdout
+    return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
+
+
+# Function to decode raw audio bytes (wav, mp3, m4a, mp4) into a 16 kHz float32 buffer
+def decode_audio(audio_bytes, sample_rate=SAMPLE_RATE):
+    try:
+        return run_ffmpeg("pipe:0", audio_bytes, sample_rate)
+    except subprocess.CalledProcessError:
+        # mp4/m4a files may keep their index at the end, which ffmpeg cannot seek to on a pipe
+        with tempfile.NamedTemporaryFile(suffix=".audio") as f:
+            f.write(audio_bytes)
+            f.flush()
+            return run_ffmpeg(f.name, sample_rate=sample_rate)
+
+
+# Function to get a 16 kHz float32 buffer from a path, raw bytes, an upload or an already decoded buffer
+def load_audio(source, sample_rate=SAMPLE_RATE):
+    if isinstance(source, np.ndarray):
+        return source
+    if isinstance(source, AudioUpload):
+        return decode_audio(source.audio_bytes, sample_rate)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return decode_audio(bytes(source), sample_rate)
+    if isinstance(source, (str, os.PathLike)):
+        try:
+            return run_ffmpeg(os.fspath(source), sample_rate=sample_rate)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"Failed to load audio {source}: {e.stderr.decode(errors='replace')}") from e
+    raise TypeError(f"Unsupported audio source: {type(source).__name__}")
+
+
+# Function to hash the content of a path, raw bytes, an upload or a decoded buffer
+def content_hash(source):
+    if isinstance(source, AudioUpload):
+        return source.content_hash
+    if isinstance(source, np.ndarray):
+        return hashlib.sha256(np.ascontiguousarray(source).tobytes()).hexdigest()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(source).hexdigest()
+    digest = hashlib.sha256()
+    with open(source, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Function to get the duration in seconds of a decoded buffer
+def audio_duration(audio, sample_rate=SAMPLE_RATE):
+    return len(audio) / sample_rate
+
+
+# Function to list the recordings of a directory or a manifest file (one path per line)
+def list_audio_files(source):
+    if os.path.isdir(source):
+        paths = glob.glob(os.path.join(source, "**", "*"), recursive=True)
+        return sorted(p for p in paths if p.lower().endswith(AUDIO_EXTENSIONS))
+    base_dir = os.path.dirname(os.path.abspath(source))
+    paths = []
+    with open(source, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                paths.append(line if os.path.isabs(line) else os.path.join(base_dir, line))
+    return paths
@@ -0,0 +1,97 @@
+import threading
+
+# Rough CPU seconds of compute per second of audio, refined from real calls as they come in
+DEFAULT_REAL_TIME_FACTORS = {
+    "tiny": 0.05,
+    "base": 0.1,
+    "small": 0.3,
+    "medium": 0.8,
+    "large-v2": 1.5,
+    "large-v3": 1.5,
+}
+
+# Whisper's own thresholds for a transcript it should decode again
+MIN_AVG_LOGPROB = -1.0
+MAX_COMPRESSION_RATIO = 2.4
+
+
+# Function to measure how sure Whisper was of a transcript, the same way its own fallback does
+def transcript_confidence(transcript):
+    segments = transcript.get("segments") or []
+    total = sum(s["end"] - s["start"] for s in segments)
+    if not total:
+        return {"avg_logprob": float("-inf"), "compression_ratio": 0.0, "no_speech_prob": 1.0}
+    return {
+        key: sum(s[key] * (s["end"] - s["start"]) for s in segments) / total
+        for key in ("avg_logprob", "compression_ratio", "no_speech_prob")
+    }
+
+
+# Picks the Whisper size of every call from the queue depth, the call duration and the latency budget
+class WhisperPolicy:
+    def __init__(self, sizes, default_size, latency_slo=10.0, min_avg_logprob=MIN_AVG_LOGPROB,
+                 max_compression_ratio=MAX_COMPRESSION_RATIO,
+                 smoothing=0.2):
+        if default_size not in sizes:
+            raise ValueError(f"Whisper size {default_size!r} is not one of the loaded sizes {', '.join(sizes)}")
+        # Smallest to largest
+        self.sizes = list(sizes)
+        self.default_size = default_size
+        self.latency_slo = latency_slo
+        self.min_avg_logprob = min_avg_logprob
+        self.max_compression_ratio = max_compression_ratio
+        self.smoothing = smoothing
+        self.lock = threading.Lock()
+        self.real_time_factors = {size: DEFAULT_REAL_TIME_FACTORS.get(size, 1.0) for size in self.sizes}
+        self.counts = {size: 0 for size in self.sizes}
+        self.escalations = 0
+
+    # Function to estimate how long a call would take on a size, counting the calls queued before it
+    def estimate(self, size, duration, queue_depth=0):
+        return (queue_depth + 1) * self.real_time_factors[size] * duration
+
+    # Function to pick the size of the first pass, degrading to smaller models when the queue grows
+    def choose(self, duration, queue_depth=0):
+        candidates = self.sizes[:self.sizes.index(self.default_size) + 1]
+        for size in reversed(candidates):
+            if self.estimate(size, duration, queue_depth) <= self.latency_slo:
+                return size
+        return candidates[0]
+
+    # Function to pick a larger size to redo a low-confidence transcript, or None to keep it
+    def escalate(self, size, transcript, duration, elapsed, queue_depth=0):
+        if size == self.sizes[-1]:
+            return None
+        confidence = transcript_confidence(transcript)
+        if (confidence["avg_logprob"] >= self.min_avg_logprob
+                and confidence["compression_ratio"] <= self.max_compression_ratio):
+            return None
+        if confidence["no_speech_prob"] > 0.6:
+            # A larger model will not find speech that is not there
+            return None
+        larger = self.sizes[-1]
+        if elapsed + self.estimate(larger, duration, queue_depth) > self.latency_slo:
+            return None
+        return larger
+
+    # Function to learn the real speed of a size from a finished call
+    def observe(self, size, duration, seconds, escalated=False):
+        if duration <= 0:
+            return
+        with self.lock:
+            factor = seconds / duration
+            self.real_time_factors[size] += self.smoothing * (factor - self.real_time_factors[size])
+            self.counts[size] += 1
+            self.escalations += escalated
+
+    def stats(self):
+        with self.lock:
+            return {"real_time_factors": dict(self.real_time_factors), "counts": dict(self.counts),
+                    "escalations": self.escalations}
+
+    # Function to take over the state of the policy that actually runs, e.g. in a stage process of sharding.py
+    def restore(self, stats):
+        with self.lock:
+            self.real_time_factors = dict(stats["real_time_factors"])
+            self.counts = dict(stats["counts"])
+            self.escalations = stats["escalations"]
@@ -0,0 +1,245 @@
+import os
+import sys
+import json
+import time
+import glob
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from audio_ingest import list_audio_files
+from blaghk import metrics, run_pipeline
+
+STAGES = ["decode", "transcribe_audio", "classify_transcript", "classify_emotion"]
+
+
+# Keeps the number of calls and seconds of every stage
+class StageStats:
+    def __init__(self, metrics=metrics):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        # The metrics know how long every stage actually ran, without the wait in the model queues
+        self.metrics = metrics
+        self.busy_at_start = metrics.wall_seconds()
+        self.calls = {stage: 0 for stage in STAGES}
+        self.seconds = {stage: 0.0 for stage in STAGES}
+        self.done = 0
+        self.failed = 0
+
+    def add(self, record):
+        with self.lock:
+            if "error" in record:
+                self.failed += 1
+            else:
+                self.done += 1
+            timings = record.get("timings", {})
+            for stage in STAGES:
+                if stage in timings:
+                    self.calls[stage] += 1
+                    self.seconds[stage] += timings[stage]
+
+    def report(self):
+        busy = self.metrics.wall_seconds()
+        with self.lock:
+            elapsed = time.perf_counter() - self.started
+            lines = [f"{self.done} calls done, {self.failed} failed, "
+                     f"{self.done / elapsed if elapsed else 0.0:.2f} calls/s overall"]
+            for stage in STAGES:
+                calls = self.calls[stage]
+                # Calls per second the stage was busy: the stage with the lowest rate limits the whole batch
+                busy_seconds = busy.get(stage, 0.0) - self.busy_at_start.get(stage, 0.0)
+                rate = calls / busy_seconds if busy_seconds else 0.0
+                # Stage timings include the wait in the model queue, so they give latency, not throughput
+                latency = self.seconds[stage] / calls if calls else 0.0
+                lines.append(f"  {stage}: {calls} calls, {rate:.2f} calls per busy second, "
+                             f"{latency:.2f}s mean latency")
+        return "\n".join(lines)
+
+
+# Function to cut off a last line left unfinished by a crash, so the next record starts on a line of its own
+def truncate_partial_line(path, block_size=65536):
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - block_size)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b"\n")
+            if newline != -1:
+                position = start + newline + 1
+                break
+            position = start
+        if position != end:
+            f.truncate(position)
+
+
+# Writes results as JSON lines, flushed after every call
+class JsonlWriter:
+    def __init__(self, output_path):
+        self.output_path = output_path
+
+    def completed(self):
+        completed = set()
+        if not os.path.exists(self.output_path):
+            return completed
+        with open(self.output_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line may be cut short by a crash
+                    continue
+                if "error" not in record:
+                    completed.add(record["path"])
+        return completed
+
+    def __enter__(self):
+        truncate_partial_line(self.output_path)
+        self.file = open(self.output_path, "a", encoding="utf-8")
+        return self
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def __exit__(self, *exc):
+        self.file.close()
+
+
+# Writes results as numbered Parquet parts inside a directory
+class ParquetWriter:
+    def __init__(self, output_path, flush_every=100):
+        self.output_path = output_path
+        self.flush_every = flush_every
+        self.rows = []
+
+    def parts(self):
+        return sorted(glob.glob(os.path.join(self.output_path, "part-*.parquet")))
+
+    def completed(self):
+        import pyarrow.parquet as pq
+        completed = set()
+        for part in self.parts():
+            table = pq.read_table(part, columns=["path", "error"]).to_pydict()
+            for path, error in zip(table["path"], table["error"]):
+                if error is None:
+                    completed.add(path)
+        return completed
+
+    def __enter__(self):
+        os.makedirs(self.output_path, exist_ok=True)
+        return self
+
+    def write(self, record):
+        self.rows.append(record)
+        if len(self.rows) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pylist([
+            {
+                "path": r["path"],
+                "error": r.get("error"),
+                "text": r.get("text"),
+                "language": r.get("language"),
+                "department": r.get("department"),
+                "emotion": r.get("emotion"),
+                "result": json.dumps(r, ensure_ascii=False),
+            }
+            for r in self.rows
+        ])
+        part = os.path.join(self.output_path, f"part-{len(self.parts()):05d}.parquet")
+        # Write then rename so a crash never leaves a half written part behind
+        pq.write_table(table, part + ".tmp")
+        os.replace(part + ".tmp", part)
+        self.rows = []
+
+    def __exit__(self, *exc):
+        self.flush()
+
+
+def open_writer(output_path, flush_every=100):
+    if output_path.endswith(".parquet"):
+        return ParquetWriter(output_path, flush_every)
+    return JsonlWriter(output_path)
+
+
+# Function to run the three stages of blaghk.py on one recording
+def triage_call(audio_file_path):
+    try:
+        result = run_pipeline(audio_file_path)
+    except Exception as e:
+        return {"path": audio_file_path, "error": f"{type(e).__name__}: {e}"}
+
+    classification_result = result["classification"]
+    emotion_result = result["emotion"]
+    return {
+        "path": audio_file_path,
+        "text": result["text"],
+        "language": result["language"],
+        "language_probs": result["language_probs"],
+        "department": classification_result["labels"][0],
+        "department_scores": dict(zip(classification_result["labels"], classification_result["scores"])),
+        "emotion": emotion_result[0]["label"],
+        "emotion_scores": {e["label"]: e["score"] for e in emotion_result},
+        "emotion_timeline": result["emotion_timeline"],
+        "cached": result["cached"],
+        "timings": result["timings"],
+    }
+
+
+# Function to triage every recording of a directory or manifest, skipping the ones already done
+def run_batch(source, output_path, workers=2, max_pending=None, flush_every=100, report_every=50):
+    max_pending = max_pending or workers * 2
+    writer = open_writer(output_path, flush_every)
+    completed = writer.completed()
+    todo = [p for p in list_audio_files(source) if p not in completed]
+    print(f"{len(completed)} calls already done, {len(todo)} to go", file=sys.stderr)
+
+    stats = StageStats()
+
+    def collect(futures):
+        for future in futures:
+            record = future.result()
+            writer.write(record)
+            stats.add(record)
+            if (stats.done + stats.failed) % report_every == 0:
+                print(stats.report(), file=sys.stderr)
+
+    with writer, ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for audio_file_path in todo:
+            # Bound the number of queued calls so memory stays flat on large shifts
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(pool.submit(triage_call, audio_file_path))
+        collect(pending)
+
+    print(stats.report(), file=sys.stderr)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the blaghk triage pipeline over many recordings.")
+    parser.add_argument("source", help="directory of recordings or manifest file with one path per line")
+    parser.add_argument("-o", "--output", default="results.jsonl",
+                        help="results file (.jsonl) or directory of parts (.parquet)")
+    parser.add_argument("-w", "--workers", type=int, default=2, help="number of worker threads")
+    parser.add_argument("--max-pending", type=int, default=None,
+                        help="maximum queued calls (default: twice the workers)")
+    parser.add_argument("--flush-every", type=int, default=100, help="rows per Parquet part")
+    parser.add_argument("--report-every", type=int, default=50, help="print throughput every N calls")
+    args = parser.parse_args()
+    run_batch(args.source, args.output, args.workers, args.max_pending, args.flush_every, args.report_every)
+
+
+if __name__ == "__main__":
+    main()
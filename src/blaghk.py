@@ -1,63 +1,543 @@
 import os
-import datetime
+import json
+import time
+import uuid
+import hashlib
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
 from audio_recorder_streamlit import audio_recorder
-from transformers import pipeline
-from langdetect import detect
 import whisper
-# Load the Whisper model
-@st.cache_resource
-def load_whisper():
-    return whisper.load_model("small")
+import transformers
+from audio_ingest import SAMPLE_RATE, AudioUpload, load_audio, audio_duration, content_hash
+from autoscale import WhisperPolicy
+from distress import DistressScorer
+from inference import InferenceServer, parse_core_groups
+from metrics import Metrics, audio_seconds, peak_rss, start_metrics_server
+from models import ModelRegistry
+from profiles import PROFILE, apply_whisper_profile, load_pipeline, quantize_int8
+from result_cache import ResultCache
+from vad import trim_silence
+from weights import find_pipeline_weights, find_whisper_weights, load_whisper_mmap
+
+# "fast" uses the trained classifier and falls back to zero-shot below the threshold, "zero-shot" never uses it
+CLASSIFIER = os.environ.get("BLAGHK_CLASSIFIER", "fast")
+FAST_CLASSIFIER_PATH = os.environ.get("BLAGHK_FAST_CLASSIFIER", "department_classifier.joblib")
+FAST_CLASSIFIER_THRESHOLD = float(os.environ.get("BLAGHK_FAST_CLASSIFIER_THRESHOLD", "0.6"))
+# "nli" runs bart-large-mnli once per department, "embedding" compares against cached department embeddings
+ZERO_SHOT_MODE = os.environ.get("BLAGHK_ZERO_SHOT", "nli")
+# Scripts that load their own models set this to "0" so nothing is loaded until it is used
+PRELOAD = os.environ.get("BLAGHK_PRELOAD", "1") == "1"
+# Whisper sizes kept resident, smallest to largest, e.g. "base,small,large-v3" to let the policy pick per call
+WHISPER_SIZES = os.environ.get("BLAGHK_WHISPER_SIZES", "small").split(",")
+WHISPER_SIZE = os.environ.get("BLAGHK_WHISPER_SIZE", "small")
+# Seconds a call may spend in Whisper, queueing included
+WHISPER_LATENCY_SLO = float(os.environ.get("BLAGHK_WHISPER_LATENCY_SLO", "10"))
+# Cut silence, hold music and line noise out of recordings before Whisper and the emotion model see them
+VAD = os.environ.get("BLAGHK_VAD", "1") == "1"
+# Long calls go through the emotion model in windows of this many seconds, a few windows at a time
+EMOTION_WINDOW_SECONDS = float(os.environ.get("BLAGHK_EMOTION_WINDOW", "8"))
+EMOTION_BATCH_SIZE = int(os.environ.get("BLAGHK_EMOTION_BATCH_SIZE", "8"))
+# "thread" runs every model in this process, "process" forks one process per model, all sharing the weights (Linux)
+SHARDING = os.environ.get("BLAGHK_SHARDING", "thread")
+# Models in the same group take turns, groups run at once with an equal share of the cores. By default every model
+# has its own group: the department classifier decides the routing and must never wait behind a batch of
+# emotion windows, which only feed the display
+CORE_GROUPS = parse_core_groups(
+    os.environ.get("BLAGHK_CORE_GROUPS", "transcribe_audio;classify_transcript;classify_emotion"))
+# Calls that sound distressed, or mention fire or injuries, jump this many seconds ahead in the model queues
+PRIORITY = os.environ.get("BLAGHK_PRIORITY", "1") == "1"
+DISTRESS_HEAD_START = float(os.environ.get("BLAGHK_DISTRESS_HEAD_START", "30"))
+
+ZERO_SHOT_MODEL = "facebook/bart-large-mnli"
+EMOTION_MODEL = "harshit345/xlsr-wav2vec-speech-emotion-recognition"
+
+DEPARTMENTS = ["الدفاع المدني", "المرور", "الاسعاف", "الشرطة"]
+HYPOTHESIS_TEMPLATE = "This is a {} call."
+
+# Load the Whisper model, memory-mapping the weights if they were converted with weights.py
+def load_whisper(profile=PROFILE, size=WHISPER_SIZE):
+    weights_path = find_whisper_weights(size)
+    model = load_whisper_mmap(weights_path) if weights_path else whisper.load_model(size)
+    return apply_whisper_profile(model, profile)
 
 # Load the zero-shot classification model
-@st.cache_resource
-def load_classifier():
-    classifier = pipeline("zero-shot-classification", model="facebook/bart-large-mnli")
+def load_classifier(profile=PROFILE):
+    if ZERO_SHOT_MODE == "embedding":
+        from embedding_classifier import EmbeddingClassifier
+        classifier = EmbeddingClassifier(DEPARTMENTS, HYPOTHESIS_TEMPLATE)
+        if profile != "fp32":
+            classifier.model = quantize_int8(classifier.model)
+            classifier.set_labels(DEPARTMENTS, HYPOTHESIS_TEMPLATE)
+        return classifier
+    classifier = load_pipeline("zero-shot-classification", find_pipeline_weights(ZERO_SHOT_MODEL), profile)
     return classifier
 
+# Load the fast department classifier trained with train_classifier.py, if there is one
+def load_fast_classifier():
+    if CLASSIFIER == "zero-shot" or not os.path.exists(FAST_CLASSIFIER_PATH):
+        return None
+    import joblib
+    fast_classifier = joblib.load(FAST_CLASSIFIER_PATH)
+    # Its labels must match the zero-shot fallback's, or one department would show under two names
+    unknown = set(map(str, fast_classifier.classes_)) - set(DEPARTMENTS)
+    if unknown:
+        raise ValueError(f"{FAST_CLASSIFIER_PATH} predicts {sorted(unknown)}, which are not in DEPARTMENTS; "
+                         f"retrain it with train_classifier.py")
+    return fast_classifier
+
 # Load the emotion classification model
+def load_emotion_classifier(profile=PROFILE):
+    return load_pipeline("audio-classification", find_pipeline_weights(EMOTION_MODEL), profile)
+
+# Single background thread that writes recordings to the archive
 @st.cache_resource
-def load_emotion_classifier():
-    return pipeline("audio-classification", model="harshit345/xlsr-wav2vec-speech-emotion-recognition")
-
-text_detection_model = load_whisper()
-zero_shot_classifier = load_classifier()
-emotion_classifier = load_emotion_classifier()
-
-# Function to save audio bytes to a file
-def save_audio_file(audio_bytes, file_extension):
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    file_name = f"audio_{timestamp}.{file_extension}"
-    with open(file_name, "wb") as f:
-        f.write(audio_bytes)
+def load_archive_executor():
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="blaghk-archive")
+
+# Recordings and transcripts are only kept on disk when an archive directory is set
+ARCHIVE_DIR = os.environ.get("BLAGHK_ARCHIVE_DIR")
+
+# Prometheus metrics are served on this port when it is set, and every stage and call is logged to the trace file
+METRICS_PORT = os.environ.get("BLAGHK_METRICS_PORT")
+TRACE_LOG = os.environ.get("BLAGHK_TRACE_LOG")
+
+# Per-stage latency, CPU time and real-time factor, shared by all sessions
+@st.cache_resource
+def load_metrics():
+    metrics = Metrics()
+    if TRACE_LOG:
+        metrics.open_trace(TRACE_LOG)
+    return metrics
+
+# Results of calls already seen are only cached when a cache file is set
+CACHE_PATH = os.environ.get("BLAGHK_CACHE_PATH")
+CACHE_MAX_MB = float(os.environ.get("BLAGHK_CACHE_MAX_MB", "256"))
+
+# Cache of results keyed by audio content, shared by all sessions
+@st.cache_resource
+def load_result_cache():
+    if not CACHE_PATH:
+        return None
+    return ResultCache(CACHE_PATH, int(CACHE_MAX_MB * 1024 * 1024))
+
+# Function to fingerprint every setting that changes the result of a call, so cached results never outlive a model change
+def model_version():
+    fast_classifier_version = None
+    if CLASSIFIER != "zero-shot" and os.path.exists(FAST_CLASSIFIER_PATH):
+        fast_classifier_version = os.path.getmtime(FAST_CLASSIFIER_PATH)
+    config = {
+        "whisper": whisper.__version__,
+        "transformers": transformers.__version__,
+        "whisper_sizes": WHISPER_SIZES,
+        "whisper_size": WHISPER_SIZE,
+        "profile": PROFILE,
+        "classifier": CLASSIFIER,
+        "fast_classifier": fast_classifier_version,
+        "fast_classifier_threshold": FAST_CLASSIFIER_THRESHOLD,
+        "zero_shot": ZERO_SHOT_MODE,
+        "departments": DEPARTMENTS,
+        "vad": VAD,
+        "emotion_window": EMOTION_WINDOW_SECONDS,
+    }
+    return hashlib.sha256(json.dumps(config, ensure_ascii=False, sort_keys=True).encode()).hexdigest()[:16]
+
+# Start loading every model in the background so the page renders straight away
+@st.cache_resource
+def load_model_registry():
+    registry = ModelRegistry({
+        **{f"whisper:{size}": partial(load_whisper, size=size) for size in WHISPER_SIZES},
+        "classifier": load_classifier,
+        "fast_classifier": load_fast_classifier,
+        "emotion_classifier": load_emotion_classifier,
+    })
+    # In process mode the models are loaded on the thread that forks, see load_inference_server
+    return registry.start() if PRELOAD and SHARDING != "process" else registry
+
+# Policy that picks the Whisper size of every call
+@st.cache_resource
+def load_whisper_policy():
+    return WhisperPolicy(WHISPER_SIZES, WHISPER_SIZE, WHISPER_LATENCY_SLO)
+
+models = load_model_registry()
+whisper_policy = load_whisper_policy()
+archive_executor = load_archive_executor()
+result_cache = load_result_cache()
+metrics = load_metrics()
+distress_scorer = DistressScorer(DISTRESS_HEAD_START)
+MODEL_VERSION = model_version()
+
+# Function to write a file atomically unless the same content is already there
+def write_once(file_name, data):
+    if os.path.exists(file_name):
+        return file_name
+    tmp_name = f"{file_name}.{os.getpid()}.tmp"
+    with open(tmp_name, "wb") as f:
+        f.write(data)
+    os.replace(tmp_name, file_name)
     return file_name
 
-# Function to transcribe audio file and return detected language
-def transcribe(audio_file_path):
-    result = text_detection_model.transcribe(audio_file_path)
-    return result
+# Function to save an upload to a content-addressed file in the archive directory
+@metrics.instrument("save_audio_file")
+def save_audio_file(audio_upload, directory=ARCHIVE_DIR):
+    os.makedirs(directory, exist_ok=True)
+    return write_once(os.path.join(directory, audio_upload.file_name), audio_upload.audio_bytes)
+
+# Function to archive a recording and its transcript in the background
+def archive_call(audio_upload, transcript_text, directory=ARCHIVE_DIR):
+    if not directory:
+        return None
+
+    def archive():
+        save_audio_file(audio_upload, directory)
+        write_once(os.path.join(directory, f"{audio_upload.stem}.txt"), transcript_text.encode("utf-8"))
 
-# Function to transcribe audio and get detected language
-def transcribe_audio(file_path):
-    transcript = transcribe(file_path)
-    text = transcript["text"]
-    language = detect(text)
-    return text, language
-
-# Function to classify the transcript
-def classify_transcript(text):
-    classes = ["الدفاع المدني", "المرور", "الاسعاف", "الشرطة"]
-    result = zero_shot_classifier(text, candidate_labels=classes, hypothesis_template="This is a {} call.")
+    return archive_executor.submit(archive)
+
+# Function to transcribe audio (a path or a decoded 16 kHz buffer) and return detected language
+@metrics.instrument("transcribe")
+def transcribe(audio, model=None, size=WHISPER_SIZE, **decode_options):
+    model = model or models.get(f"whisper:{size}")
+    result = model.transcribe(load_audio(audio), **decode_options)
     return result
 
-# Function to classify emotion of audio
-def classify_emotion(audio_file_path):
-    with open(audio_file_path, "rb") as f:
-        audio_data = f.read()
-    result = emotion_classifier(audio_data)
+# Function to detect the spoken language from the first 30 seconds, as Whisper itself does
+def detect_language(audio, model=None, size=WHISPER_SIZE):
+    model = model or models.get(f"whisper:{size}")
+    mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(load_audio(audio)), n_mels=model.dims.n_mels)
+    _, probs = model.detect_language(mel.to(model.device))
+    language = max(probs, key=probs.get)
+    top_probs = dict(sorted(probs.items(), key=lambda item: item[1], reverse=True)[:5])
+    return language, top_probs
+
+# Function to transcribe with the Whisper size the policy picks, redoing unsure transcripts on a larger model
+@metrics.instrument("transcribe_audio")
+def transcribe_scaled(audio, queue_depth=None):
+    audio = load_audio(audio)
+    duration = audio_duration(audio)
+    if queue_depth is None:
+        queue_depth = inference_server.queue_depth("transcribe_audio")
+    start = time.perf_counter()
+
+    size = whisper_policy.choose(duration, queue_depth)
+    # Detect the language once and pin it, so decoding does not detect it again
+    language, language_probs = detect_language(audio, size=size)
+    transcript = transcribe(audio, size=size, language=language)
+    elapsed = time.perf_counter() - start
+    whisper_policy.observe(size, duration, elapsed)
+
+    larger = whisper_policy.escalate(size, transcript, duration, elapsed, queue_depth)
+    if larger:
+        escalation_start = time.perf_counter()
+        transcript = transcribe(audio, size=larger, language=language)
+        whisper_policy.observe(larger, duration, time.perf_counter() - escalation_start, escalated=True)
+    transcript["language_probs"] = language_probs
+    transcript["whisper_size"] = larger or size
+    return transcript
+
+# Function to classify transcripts with the zero-shot model
+def classify_transcripts_zero_shot(texts, zero_shot_classifier=None):
+    zero_shot_classifier = zero_shot_classifier or models.get("classifier")
+    if ZERO_SHOT_MODE == "embedding":
+        results = zero_shot_classifier(texts)
+    else:
+        results = zero_shot_classifier(texts, candidate_labels=DEPARTMENTS, hypothesis_template=HYPOTHESIS_TEMPLATE)
+    if isinstance(results, dict):
+        results = [results]
+    for result in results:
+        result["model"] = f"zero-shot-{ZERO_SHOT_MODE}"
+    return results
+
+# Function to classify transcripts, keeping the zero-shot model for the calls the fast one is unsure about.
+# The model worker calls it once per batch, so the classify_transcript stage counts batches
+@metrics.instrument("classify_transcript")
+def classify_transcripts(texts):
+    fast_classifier = models.get("fast_classifier")
+    results = [None] * len(texts)
+    unsure = list(range(len(texts)))
+    if fast_classifier is not None:
+        unsure = []
+        for i, probabilities in enumerate(fast_classifier.predict_proba(texts)):
+            ranking = probabilities.argsort()[::-1]
+            if probabilities[ranking[0]] < FAST_CLASSIFIER_THRESHOLD:
+                unsure.append(i)
+                continue
+            results[i] = {
+                "sequence": texts[i],
+                "labels": [str(fast_classifier.classes_[j]) for j in ranking],
+                "scores": [float(probabilities[j]) for j in ranking],
+                "model": "fast",
+            }
+    if unsure:
+        for i, result in zip(unsure, classify_transcripts_zero_shot([texts[i] for i in unsure])):
+            results[i] = result
+    return results
+
+# Function to classify emotion of several decoded 16 kHz buffers in one batch
+def classify_emotions(audios, emotion_classifier=None, top_k=None):
+    emotion_classifier = emotion_classifier or models.get("emotion_classifier")
+    inputs = [{"raw": audio, "sampling_rate": SAMPLE_RATE} for audio in audios]
+    top_k = top_k or len(emotion_classifier.model.config.id2label)
+    return emotion_classifier(inputs, batch_size=len(inputs), top_k=top_k)
+
+# Function to cut a buffer into fixed-length windows without copying it, the last one ending with the audio
+def emotion_windows(audio, window_seconds=EMOTION_WINDOW_SECONDS):
+    window = int(window_seconds * SAMPLE_RATE)
+    start = 0
+    while True:
+        yield start, audio[start:start + window]
+        if start + window >= len(audio):
+            return
+        start = min(start + window, len(audio) - window)
+
+# Function to classify emotion of calls window by window, a batch of windows at a time so memory stays flat.
+# The model worker calls it once per batch of calls, so the classify_emotion stage counts batches
+@metrics.instrument("classify_emotion")
+def classify_emotion_timelines(audios, window_seconds=EMOTION_WINDOW_SECONDS, batch_size=EMOTION_BATCH_SIZE,
+                               emotion_classifier=None):
+    totals = [{} for _ in audios]
+    weights = [0] * len(audios)
+    timelines = [[] for _ in audios]
+    batch = []
+
+    def flush():
+        results = classify_emotions([window for _, _, window in batch], emotion_classifier)
+        for (i, start, window), scores in zip(batch, results):
+            weights[i] += len(window)
+            for score in scores:
+                totals[i][score["label"]] = totals[i].get(score["label"], 0.0) + score["score"] * len(window)
+            timelines[i].append({
+                "start": start / SAMPLE_RATE,
+                "end": (start + len(window)) / SAMPLE_RATE,
+                "label": scores[0]["label"],
+                "score": scores[0]["score"],
+            })
+        batch.clear()
+
+    # Windows of different calls share batches, so short calls arriving together are still batched
+    for i, audio in enumerate(audios):
+        for start, window in emotion_windows(audio, window_seconds):
+            batch.append((i, start, window))
+            if len(batch) == batch_size:
+                flush()
+    if batch:
+        flush()
+
+    results = []
+    for total, weight, timeline in zip(totals, weights, timelines):
+        distribution = [{"label": label, "score": score / weight} for label, score in total.items()]
+        distribution.sort(key=lambda item: item["score"], reverse=True)
+        results.append({"distribution": distribution, "timeline": timeline})
+    return results
+
+# Function to transcribe several decoded buffers; Whisper's transcribe has no batch mode, so one at a time
+def transcribe_audios(audios, queue_depth=None):
+    return [transcribe_scaled(audio, queue_depth) for audio in audios]
+
+# Function to transcribe segments of live calls (dicts with the audio, the language of the call, None until it is
+# detected on the first segment, and the text so far as prompt) with the usual Whisper size
+def transcribe_segments(segments):
+    results = []
+    for segment in segments:
+        language = segment["language"] or detect_language(segment["audio"])[0]
+        results.append(transcribe(segment["audio"], language=language, initial_prompt=segment["initial_prompt"]))
+    return results
+
+# Function to take in what a stage process recorded while running a batch
+def merge_shard_report(report):
+    metrics.merge(report["metrics"])
+    if "policy" in report:
+        whisper_policy.restore(report["policy"])
+
+# Micro-batching workers for the three models, shared by all sessions
+@st.cache_resource
+def load_inference_server():
+    stages = {
+        "transcribe_audio": (transcribe_audios, 1),
+        "transcribe_segment": (transcribe_segments, 1),
+        "classify_transcript": (classify_transcripts, 16),
+        "classify_emotion": (classify_emotion_timelines, 4),
+    }
+    # Live segments run on the same Whisper models as whole calls. Two decodes on one model at once mix up each
+    # other's key/value caches, so they always take turns, whatever the core groups say
+    core_groups = {**CORE_GROUPS, "transcribe_segment": CORE_GROUPS.get("transcribe_audio", "transcribe_audio")}
+    groups = {name: core_groups.get(name, name) for name in stages}
+    threads = max(1, (os.cpu_count() or 1) // len(set(groups.values())))
+    if SHARDING == "process":
+        from sharding import shard_stages
+        # Every model is loaded here, on this thread and before forking, so the stage processes share one copy
+        # of the weights and no loader thread is left running at the fork.
+        # The Whisper policy runs inside its stage process with the queue depth sent from here, and the metrics
+        # and policy state of every batch are sent back, so /metrics shows them as in a single process
+        stages = shard_stages(
+            stages,
+            [partial(models.load_now, name) for name in models.loaders],
+            {"transcribe_audio": lambda: {"queue_depth": inference_server.queue_depth("transcribe_audio")}},
+            threads,
+            reports={
+                "transcribe_audio": lambda: {"metrics": metrics.take(), "policy": whisper_policy.stats()},
+                "transcribe_segment": lambda: {"metrics": metrics.take()},
+                "classify_transcript": lambda: {"metrics": metrics.take()},
+                "classify_emotion": lambda: {"metrics": metrics.take()},
+            },
+            on_report=merge_shard_report,
+        )
+    return InferenceServer(stages, core_groups, threads=threads)
+
+inference_server = load_inference_server()
+
+# Function to get the gauges of the shared workers, cache and models at scrape time
+def service_gauges():
+    gauges = {}
+    for stage, stats in inference_server.stats().items():
+        gauges[f'queue_depth{{stage="{stage}"}}'] = stats["queued"]
+        gauges[f'mean_batch_size{{stage="{stage}"}}'] = stats["mean_batch_size"]
+    for name, status in models.status().items():
+        gauges[f'model_ready{{model="{name}"}}'] = int(status == "ready")
+    if result_cache is not None:
+        for name, value in result_cache.stats().items():
+            gauges[f"result_cache_{name}"] = value
+    gauges["whisper_escalations_total"] = whisper_policy.stats()["escalations"]
+    return gauges
+
+# Serve /metrics once per process, not once per session
+@st.cache_resource
+def load_metrics_server():
+    metrics.add_collector(service_gauges)
+    if not METRICS_PORT:
+        return None
+    return start_metrics_server(metrics, int(METRICS_PORT))
+
+metrics_server = load_metrics_server()
+
+# Function to run a stage and store how long it took
+def timed(timings, stage, function, *args):
+    start = time.perf_counter()
+    try:
+        with metrics.measure(stage, audio_seconds(args[0]) if args else None):
+            return function(*args)
+    finally:
+        timings[stage] = time.perf_counter() - start
+
+# Function to wait for a model worker and store how long the request took, queueing included
+def timed_result(timings, stage, future):
+    result = future.result()
+    timings[stage] = future.completed_at - future.submitted_at
     return result
 
+# Function to tell whether the policy picked a smaller Whisper than the default size
+def smaller_than_default(size):
+    if WHISPER_SIZE not in WHISPER_SIZES or size not in WHISPER_SIZES:
+        return size != WHISPER_SIZE
+    return WHISPER_SIZES.index(size) < WHISPER_SIZES.index(WHISPER_SIZE)
+
+# Function to log one line with the timings of a whole call to the trace file
+def trace_call(call_id, timings, duration, cached):
+    metrics.trace({
+        "call_id": call_id,
+        "stage": "call",
+        "timings": timings,
+        "audio_seconds": duration,
+        "real_time_factor": timings["total"] / duration if duration else None,
+        "peak_rss": peak_rss(),
+        "cached": cached,
+    })
+
+# Function to run the whole pipeline, classifying the emotion while Whisper transcribes;
+# on_stage, if given, is called with the name and result of every stage as soon as it is done
+def run_pipeline(audio_source, on_stage=None):
+    call_id = uuid.uuid4().hex
+    timings = {}
+    start = time.perf_counter()
+
+    # Duplicate calls, retries and QA re-runs get the stored result without running any model
+    cache_key = None
+    if result_cache is not None:
+        cache_key = f"{timed(timings, 'hash', content_hash, audio_source)}:{MODEL_VERSION}"
+        cached_result = result_cache.get(cache_key)
+        if cached_result is not None:
+            timings["total"] = time.perf_counter() - start
+            trace_call(call_id, timings, cached_result["duration"], cached=True)
+            if on_stage:
+                on_stage("transcript", {key: cached_result[key] for key in ("text", "language", "language_probs",
+                                                                            "segments")})
+                on_stage("classification", cached_result["classification"])
+                on_stage("emotion", {"distribution": cached_result["emotion"],
+                                     "timeline": cached_result["emotion_timeline"]})
+            return {**cached_result, "cached": True, "timings": timings}
+
+    # Decode once and hand the same buffer to Whisper and the emotion model
+    audio = timed(timings, "decode", load_audio, audio_source)
+    duration = audio_duration(audio)
+    time_map = None
+    if VAD:
+        audio, time_map = timed(timings, "vad", trim_silence, audio)
+
+    # How agitated the caller sounds in the first seconds decides how soon Whisper gets to the call
+    distress = timed(timings, "distress", distress_scorer.score, audio)
+    priority = distress_scorer.priority(distress) if PRIORITY else 0.0
+
+    # The emotion model only needs the audio, so it does not wait for the transcript
+    emotion_future = inference_server.submit("classify_emotion", audio, priority)
+    transcript_future = inference_server.submit("transcribe_audio", audio, priority)
+
+    transcript = timed_result(timings, "transcribe_audio", transcript_future)
+    transcript_text = transcript["text"]
+    segments = [
+        {
+            "start": time_map.to_original(segment["start"]) if time_map else segment["start"],
+            "end": time_map.to_original(segment["end"]) if time_map else segment["end"],
+            "text": segment["text"],
+        }
+        for segment in transcript["segments"]
+    ]
+    if on_stage:
+        on_stage("transcript", {"text": transcript_text, "language": transcript["language"],
+                                "language_probs": transcript["language_probs"], "segments": segments})
+    # The transcript, and the emotion if it is already known, can only raise the priority for the classifier
+    early_emotion = None
+    if emotion_future.done() and emotion_future.exception() is None:
+        early_emotion = emotion_future.result()["distribution"]
+    distress = distress_scorer.score(audio, transcript_text, early_emotion)
+    priority = distress_scorer.priority(distress) if PRIORITY else 0.0
+    classification_future = inference_server.submit("classify_transcript", transcript_text, priority)
+    classification_result = timed_result(timings, "classify_transcript", classification_future)
+    timings["routing"] = time.perf_counter() - start
+    if on_stage:
+        on_stage("classification", classification_result)
+
+    emotion_result = timed_result(timings, "classify_emotion", emotion_future)
+    emotion_timeline = [
+        {
+            **window,
+            "start": time_map.to_original(window["start"]) if time_map else window["start"],
+            "end": time_map.to_original(window["end"]) if time_map else window["end"],
+        }
+        for window in emotion_result["timeline"]
+    ]
+    if on_stage:
+        on_stage("emotion", {"distribution": emotion_result["distribution"], "timeline": emotion_timeline})
+    pipeline_result = {
+        "text": transcript_text,
+        "language": transcript["language"],
+        "language_probs": transcript["language_probs"],
+        "segments": segments,
+        "whisper_size": transcript["whisper_size"],
+        "duration": duration,
+        "speech_duration": audio_duration(audio),
+        "classification": classification_result,
+        "emotion": emotion_result["distribution"],
+        "emotion_timeline": emotion_timeline,
+        "distress": distress,
+    }
+    if cache_key is not None:
+        # A transcript from a smaller model than usual, e.g. picked under surge load, must not outlive the surge
+        if not smaller_than_default(transcript["whisper_size"]):
+            result_cache.put(cache_key, pipeline_result)
+    timings["total"] = time.perf_counter() - start
+    trace_call(call_id, timings, duration, cached=False)
+    return {**pipeline_result, "cached": False, "timings": timings}
+
 def main():
     rtl_and_custom_font_style = """
     <style>
@@ -90,13 +570,20 @@ def main():
 
 
 
+    # Let the user know while the models are still loading in the background
+    if not models.all_ready():
+        st.info("جاري تحميل النماذج، يمكنك التسجيل أو رفع صوتية الآن")
+
     tab1, tab2 = st.tabs(["سجل صوتية", "ارفع صوتية"])
 
+    # The recording of this session, kept in memory
+    audio_upload = None
+
     # Record Audio tab
     with tab1:
         audio_bytes = audio_recorder()
         if audio_bytes:
-            audio_file = save_audio_file(audio_bytes, "wav")
+            audio_upload = AudioUpload(audio_bytes, "wav")
             st.audio(audio_bytes, format="audio/wav")
 
     # Upload Audio tab
@@ -104,45 +591,51 @@ def main():
         audio_file = st.file_uploader("Upload Audio", type=["mp3", "mp4", "wav", "m4a"])
         if audio_file:
             file_extension = audio_file.type.split('/')[1]
-            audio_file_path = save_audio_file(audio_file.read(), file_extension)
+            audio_upload = AudioUpload(audio_file.getvalue(), file_extension)
 
     # Transcribe, classify, and detect emotion button action
     if st.button("ابدأ"):
-        # Find the newest audio file
-        audio_file_path = max(
-            [f for f in os.listdir(".") if f.startswith("audio")],
-            key=os.path.getctime,
-        )
+        if audio_upload is None:
+            st.warning("سجل أو ارفع صوتية أولاً")
+            return
 
-        # Transcribe the audio file
-        transcript_text, detected_language = transcribe_audio(audio_file_path)
+        # Transcribe, classify and detect the emotion of the audio
+        pipeline_result = run_pipeline(audio_upload)
+        transcript_text = pipeline_result["text"]
+        detected_language = pipeline_result["language"]
 
         # Display the transcript and detected language
         #st.header("Transcript")
         #st.write(transcript_text)
         
         st.header("اللغة")
-        st.write(detected_language)
+        st.write(f"{detected_language} ({pipeline_result['language_probs'][detected_language]:.0%})")
 
-        # Classify the transcript
-        classification_result = classify_transcript(transcript_text)
+        # Display the classification of the transcript
+        classification_result = pipeline_result["classification"]
         st.header("تصنيف البلاغ")
         st.write(f"القطاع: {classification_result['labels'][0]}")
 
-        # Classify the emotion
-        emotion_result = classify_emotion(audio_file_path)
+        # Display the emotion
+        emotion_result = pipeline_result["emotion"]
         st.header("شعور المتصل")
         st.write(f"الشعور: {emotion_result[0]['label']}")
+        if len(pipeline_result["emotion_timeline"]) > 1:
+            with st.expander("الشعور خلال المكالمة"):
+                st.table(pipeline_result["emotion_timeline"])
+
+        # Display how long every stage took
+        with st.expander("التوقيت"):
+            st.json({stage: round(seconds, 3) for stage, seconds in pipeline_result["timings"].items()})
 
-        # Save the transcript to a text file
-        with open(f"{audio_file_path.split('.')[0]}.txt", "w") as f:
-            f.write(transcript_text)
+        # Archive the recording and transcript without making the user wait
+        archive_call(audio_upload, transcript_text)
 
         # Provide a download button for the transcript
         st.download_button(
             label="تحميل الكتابة",
             data=transcript_text,
-            file_name=f"{audio_file_path.split('.')[0]}.txt",
+            file_name=f"{audio_upload.stem}.txt",
             mime="text/plain"
         )
 
@@ -0,0 +1,195 @@
+import sys
+import time
+import sqlite3
+import argparse
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import torch
+import whisper
+
+from autoscale import MAX_COMPRESSION_RATIO, MIN_AVG_LOGPROB
+from audio_ingest import content_hash, list_audio_files, load_audio
+from weights import find_whisper_weights, load_whisper_mmap
+
+# Whisper decodes 30 second windows
+SEGMENT_SAMPLES = whisper.audio.N_SAMPLES
+# Windows that look like a repetition loop or a guess are decoded again at these temperatures, as transcribe() does
+FALLBACK_TEMPERATURES = (0.2, 0.4, 0.6, 0.8, 1.0)
+NO_SPEECH_THRESHOLD = 0.6
+
+
+# Results table, one row per file and model, so a new model re-transcribes everything incrementally
+class TranscriptionTable:
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS transcriptions ("
+            "content_hash TEXT NOT NULL, model TEXT NOT NULL, path TEXT NOT NULL, text TEXT NOT NULL, "
+            "language TEXT, segments INTEGER NOT NULL, seconds REAL NOT NULL, "
+            "PRIMARY KEY (content_hash, model))"
+        )
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(transcriptions)")}
+        if "flagged" not in columns:
+            # Windows still unreliable after every fallback temperature, to leave out of training
+            self.db.execute("ALTER TABLE transcriptions ADD COLUMN flagged INTEGER NOT NULL DEFAULT 0")
+        self.db.commit()
+
+    def done(self, model_name):
+        rows = self.db.execute("SELECT content_hash FROM transcriptions WHERE model = ?", (model_name,))
+        return {row[0] for row in rows}
+
+    # Function to save one finished file, committed straight away so a crash loses at most one batch
+    def save(self, key, model_name, path, text, language, segments, seconds, flagged=0):
+        self.db.execute(
+            "INSERT OR REPLACE INTO transcriptions "
+            "(content_hash, model, path, text, language, segments, seconds, flagged) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, model_name, path, text, language, segments, seconds, flagged),
+        )
+        self.db.commit()
+
+    def texts(self, model_name):
+        rows = self.db.execute("SELECT content_hash, text FROM transcriptions WHERE model = ?", (model_name,))
+        return dict(rows.fetchall())
+
+
+# Function to decode a file and cut it into 30 second log-mel windows
+def load_segments(path, n_mels):
+    audio = load_audio(path)
+    segments = []
+    for start in range(0, max(len(audio), 1), SEGMENT_SAMPLES):
+        window = whisper.pad_or_trim(audio[start:start + SEGMENT_SAMPLES])
+        segments.append(whisper.log_mel_spectrogram(window, n_mels=n_mels))
+    return segments
+
+
+# Function to decode a batch of mel windows in one forward pass per token
+def decode_batch(model, mels, language=None, temperature=0.0):
+    options = whisper.DecodingOptions(language=language, temperature=temperature, without_timestamps=True,
+                                      fp16=model.device.type == "cuda")
+    return whisper.decode(model, torch.stack(mels).to(model.device), options)
+
+
+def is_silence(result):
+    return result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob < MIN_AVG_LOGPROB
+
+
+def is_unreliable(result):
+    return result.compression_ratio > MAX_COMPRESSION_RATIO or result.avg_logprob < MIN_AVG_LOGPROB
+
+
+# Function to decode a batch greedily, then decode the unreliable windows again at higher temperatures
+def decode_with_fallback(model, mels, language=None):
+    results = decode_batch(model, mels, language)
+    for temperature in FALLBACK_TEMPERATURES:
+        retry = [i for i, result in enumerate(results) if is_unreliable(result) and not is_silence(result)]
+        if not retry:
+            break
+        for i, result in zip(retry, decode_batch(model, [mels[i] for i in retry], language, temperature)):
+            results[i] = result
+    return results
+
+
+# Function to transcribe every file not yet in the table for this model, batching windows across files
+def bulk_transcribe(paths, table, model_name="large-v3", batch_size=16, loaders=4, language=None):
+    weights_path = find_whisper_weights(model_name)
+    model = load_whisper_mmap(weights_path) if weights_path else whisper.load_model(model_name)
+    done = table.done(model_name)
+    keys = [content_hash(path) for path in paths]
+    todo = list({key: path for path, key in zip(paths, keys) if key not in done}.items())
+    print(f"{len(paths) - len(todo)} files already transcribed with {model_name}, {len(todo)} to go",
+          file=sys.stderr)
+
+    # Per file: path, key, windows left, texts, languages, start time
+    pending = {}
+    batch = []
+
+    def run_batch():
+        results = decode_with_fallback(model, [mel for _, _, mel in batch], language)
+        for (key, index, _), result in zip(batch, results):
+            state = pending[key]
+            # Whisper invents text for silent windows, such as the padded end of a call
+            if is_silence(result):
+                state["texts"][index] = ""
+            else:
+                state["texts"][index] = result.text.strip()
+                state["languages"].append(result.language)
+                state["flagged"] += is_unreliable(result)
+            state["left"] -= 1
+            if state["left"] == 0:
+                languages = Counter(state["languages"]).most_common(1)
+                table.save(key, model_name, state["path"], " ".join(filter(None, state["texts"])),
+                           languages[0][0] if languages else None, len(state["texts"]),
+                           time.perf_counter() - state["started"], state["flagged"])
+                del pending[key]
+        batch.clear()
+
+    def load(key, path):
+        try:
+            return key, path, load_segments(path, model.dims.n_mels)
+        except Exception as e:
+            print(f"skipping {path}: {e}", file=sys.stderr)
+            return key, path, None
+
+    # Files are decoded by ffmpeg on a few threads while the model works on the previous batch,
+    # with only a few files read ahead so memory stays flat
+    def prefetch(pool):
+        queued = deque()
+        for key, path in todo:
+            queued.append(pool.submit(load, key, path))
+            if len(queued) > 2 * loaders:
+                yield queued.popleft().result()
+        while queued:
+            yield queued.popleft().result()
+
+    with ThreadPoolExecutor(max_workers=loaders) as pool:
+        started = time.perf_counter()
+        for finished, (key, path, segments) in enumerate(prefetch(pool), 1):
+            if segments is None:
+                continue
+            pending[key] = {"path": path, "left": len(segments), "texts": [""] * len(segments), "languages": [],
+                            "flagged": 0, "started": time.perf_counter()}
+            for index, mel in enumerate(segments):
+                batch.append((key, index, mel))
+                if len(batch) == batch_size:
+                    run_batch()
+            if finished % 50 == 0:
+                rate = finished / (time.perf_counter() - started)
+                print(f"{finished}/{len(todo)} files loaded, {rate:.2f} files/s", file=sys.stderr)
+        if batch:
+            run_batch()
+    return table.texts(model_name)
+
+
+# Function to read the paths to transcribe from a CSV with a path column, a directory or a manifest
+def read_paths(source, path_column="path"):
+    if source.endswith(".csv"):
+        return pd.read_csv(source)[path_column].tolist()
+    return list_audio_files(source)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe a whole dataset with Whisper, batching and checkpointing.")
+    parser.add_argument("source", help="CSV with a path column (e.g. df.csv), directory or manifest")
+    parser.add_argument("--table", default="transcriptions.sqlite", help="results table")
+    parser.add_argument("--model", default="large-v3")
+    parser.add_argument("--batch-size", type=int, default=16, help="30 second windows per forward pass")
+    parser.add_argument("--loaders", type=int, default=4, help="threads decoding audio files")
+    parser.add_argument("--language", default=None, help="skip language detection, e.g. ar")
+    parser.add_argument("--path-column", default="path")
+    parser.add_argument("--output-csv", help="write the source CSV back out with a transcription column")
+    args = parser.parse_args()
+
+    paths = read_paths(args.source, args.path_column)
+    table = TranscriptionTable(args.table)
+    texts = bulk_transcribe(paths, table, args.model, args.batch_size, args.loaders, args.language)
+
+    if args.output_csv:
+        df = pd.read_csv(args.source) if args.source.endswith(".csv") else pd.DataFrame({args.path_column: paths})
+        df["transcription"] = [texts.get(content_hash(path)) for path in df[args.path_column]]
+        df.to_csv(args.output_csv, index=False)
+
+
+if __name__ == "__main__":
+    main()
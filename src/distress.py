@@ -0,0 +1,74 @@
+import re
+
+import numpy as np
+
+from audio_ingest import SAMPLE_RATE
+from vad import FRAME_MS, frame_energy
+
+# Words that mean a life or a building is at risk, in Arabic (normalized, see normalize_arabic) and English
+DISTRESS_KEYWORDS = [
+    "حريق", "حرايق", "نار", "دخان", "انفجار", "احتراق",
+    "اصابه", "مصاب", "مصابين", "جرح", "جريح", "نزيف", "دم",
+    "حادث", "دهس", "انقلاب", "غرق", "اغماء", "مغمى", "ما يتنفس", "لا يتنفس", "سكته",
+    "طعن", "سلاح", "مسدس", "رصاص", "خطف", "ميت", "وفاه",
+    "fire", "smoke", "explosion", "injury", "injured", "bleeding", "blood", "accident", "drowning",
+    "unconscious", "not breathing", "stabbed", "gun", "shot",
+]
+
+# Labels of the emotion model that mean the caller is afraid or angry
+DISTRESS_EMOTIONS = {"fear", "anger"}
+
+DIACRITICS = re.compile("[\u0617-\u061a\u064b-\u0652\u0640]")
+
+
+# Function to fold the spellings of Arabic letters that transcripts mix up into one form
+def normalize_arabic(text):
+    text = DIACRITICS.sub("", text.lower())
+    text = re.sub("[إأآ]", "ا", text)
+    return text.replace("ة", "ه").replace("ى", "ي")
+
+
+# Arabic attaches "and", "the" and prepositions to the word, so they may come before a keyword
+KEYWORD_PATTERN = re.compile(
+    r"(?<!\w)(?:وال|بال|فال|لل|ال|و|ف|ب|ل)?("
+    + "|".join(re.escape(normalize_arabic(keyword)) for keyword in DISTRESS_KEYWORDS) + r")(?!\w)"
+)
+
+
+# Function to find the distress keywords in a (partial) transcript
+def spot_keywords(text):
+    return sorted(set(KEYWORD_PATTERN.findall(normalize_arabic(text))))
+
+
+# Function to estimate how agitated a caller sounds from the first seconds, between 0 and 1.
+# Shouting is loud and its loudness swings; calm speech is quieter and steadier
+def arousal(audio, seconds=4.0, sample_rate=SAMPLE_RATE):
+    frame_length = sample_rate * FRAME_MS // 1000
+    energy = frame_energy(audio[:int(seconds * sample_rate)], frame_length)
+    voiced = energy[energy > -45.0]
+    if len(voiced) < 5:
+        return 0.0
+    loudness = np.clip((np.percentile(voiced, 90) + 30.0) / 25.0, 0.0, 1.0)
+    variability = np.clip((voiced.std() - 4.0) / 8.0, 0.0, 1.0)
+    return float(0.7 * loudness + 0.3 * variability)
+
+
+# Turns the early signals of a call into the head start it gets in the model queues
+class DistressScorer:
+    def __init__(self, head_start=30.0, arousal_threshold=0.6):
+        self.head_start = head_start
+        self.arousal_threshold = arousal_threshold
+
+    # Function to score a call from its audio and, once they are there, its transcript and emotion
+    def score(self, audio=None, text=None, emotion=None):
+        level = arousal(audio) if audio is not None and len(audio) else 0.0
+        keywords = spot_keywords(text) if text else []
+        emotion_label = emotion[0]["label"] if emotion else None
+        # Below the threshold arousal is mostly a loud line, not a caller in distress
+        distress = max(level if level >= self.arousal_threshold else 0.0,
+                       1.0 if keywords or emotion_label in DISTRESS_EMOTIONS else 0.0)
+        return {"arousal": level, "keywords": keywords, "emotion": emotion_label, "distress": distress}
+
+    # Function to get the seconds a call with this score is moved ahead in the queues
+    def priority(self, score):
+        return self.head_start * score["distress"]
@@ -0,0 +1,49 @@
+import torch
+import torch.nn.functional as F
+from transformers import AutoModel, AutoTokenizer
+
+EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+
+# Zero-shot classifier that compares one transcript embedding with label embeddings computed once
+class EmbeddingClassifier:
+    def __init__(self, labels, hypothesis_template="This is a {} call.", model_name=EMBEDDING_MODEL,
+                 temperature=0.05):
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).eval()
+        self.temperature = temperature
+        self.set_labels(labels, hypothesis_template)
+
+    # Function to (re)compute the cached label embeddings, e.g. when sub-categories are added
+    def set_labels(self, labels, hypothesis_template="This is a {} call."):
+        self.labels = list(labels)
+        self.label_embeddings = self.encode([hypothesis_template.format(label) for label in self.labels])
+
+    # Function to turn texts into normalised mean-pooled sentence embeddings
+    @torch.inference_mode()
+    def encode(self, texts, batch_size=32):
+        embeddings = []
+        for i in range(0, len(texts), batch_size):
+            inputs = self.tokenizer(texts[i:i + batch_size], padding=True, truncation=True, return_tensors="pt")
+            hidden = self.model(**inputs).last_hidden_state
+            mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            embeddings.append(F.normalize(pooled, dim=-1))
+        return torch.cat(embeddings)
+
+    # Function to classify one transcript (or a list of them) like the zero-shot pipeline does
+    def __call__(self, texts):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        # One encoder pass per transcript, whatever the number of labels
+        similarities = self.encode(texts) @ self.label_embeddings.T
+        probabilities = torch.softmax(similarities / self.temperature, dim=-1)
+        results = []
+        for text, scores in zip(texts, probabilities):
+            scores, order = scores.sort(descending=True)
+            results.append({
+                "sequence": text,
+                "labels": [self.labels[i] for i in order.tolist()],
+                "scores": scores.tolist(),
+            })
+        return results[0] if single else results
@@ -0,0 +1,131 @@
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import librosa
+
+from audio_ingest import content_hash, list_audio_files
+
+# librosa.load's default rate, which test1.h5 was trained with
+SAMPLE_RATE = 22050
+N_MFCC = 40
+HOP_LENGTH = 512
+
+
+# Function to compute the mean MFCCs of several clips with one batched STFT
+def batch_mfcc(clips, sr=SAMPLE_RATE, n_mfcc=N_MFCC):
+    lengths = [len(clip) for clip in clips]
+    batch = np.zeros((len(clips), max(lengths)), np.float32)
+    for i, clip in enumerate(clips):
+        batch[i, :len(clip)] = clip
+    # librosa (>= 0.10) pads centred frames with zeros as well, so every clip's frames match an unbatched run
+    mel = librosa.feature.melspectrogram(y=batch, sr=sr, hop_length=HOP_LENGTH)
+    features = np.empty((len(clips), n_mfcc), np.float32)
+    for i, length in enumerate(lengths):
+        frames = 1 + length // HOP_LENGTH
+        # dB scaling clips relative to the loudest bin, so it has to be done per clip
+        mfcc = librosa.feature.mfcc(S=librosa.power_to_db(mel[i, :, :frames]), n_mfcc=n_mfcc)
+        features[i] = mfcc.mean(axis=1)
+    return features
+
+
+# Function to load and featurize one chunk of files, run in a worker process
+def extract_chunk(paths, sr=SAMPLE_RATE, n_mfcc=N_MFCC):
+    clips = [librosa.load(path, sr=sr)[0] for path in paths]
+    return batch_mfcc(clips, sr, n_mfcc)
+
+
+# Memory-mapped store of one feature row per audio file, keyed by the file's content hash
+class FeatureStore:
+    def __init__(self, directory, n_features=N_MFCC, sample_rate=SAMPLE_RATE):
+        self.directory = directory
+        self.n_features = n_features
+        self.config = {"n_features": n_features, "sample_rate": sample_rate, "hop_length": HOP_LENGTH}
+        self.data_path = os.path.join(directory, "features.f32")
+        self.index_path = os.path.join(directory, "index.json")
+        os.makedirs(directory, exist_ok=True)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                saved = json.load(f)
+            if saved["config"] != self.config:
+                raise ValueError(f"Feature store {directory} was built with {saved['config']}, not {self.config}")
+            self.index = saved["index"]
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    # Function to append feature rows and record where they are
+    def add(self, keys, features):
+        features = np.ascontiguousarray(features, dtype=np.float32)
+        with open(self.data_path, "ab") as f:
+            first_row = f.tell() // (4 * self.n_features)
+            f.write(features.tobytes())
+        for i, key in enumerate(keys):
+            self.index[key] = first_row + i
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"config": self.config, "index": self.index}, f)
+        os.replace(tmp_path, self.index_path)
+
+    # Function to map the whole store into memory without reading it
+    def array(self):
+        return np.memmap(self.data_path, dtype=np.float32, mode="r").reshape(-1, self.n_features)
+
+    def get(self, keys):
+        if not keys:
+            return np.empty((0, self.n_features), np.float32)
+        return self.array()[[self.index[key] for key in keys]]
+
+
+# Function to get the MFCC features of many files, computing only the ones the store does not have yet
+def extract_features(paths, store, workers=os.cpu_count(), chunk_size=32):
+    keys = [content_hash(path) for path in paths]
+    missing = {}
+    for path, key in zip(paths, keys):
+        if key not in store and key not in missing:
+            missing[key] = path
+
+    # Files of similar size share a batch, so little time is spent on padding
+    todo = sorted(missing.items(), key=lambda item: os.path.getsize(item[1]))
+    chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+    if chunks:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            sample_rate = store.config["sample_rate"]
+            futures = {}
+            for chunk in chunks:
+                chunk_paths = [path for _, path in chunk]
+                futures[pool.submit(extract_chunk, chunk_paths, sample_rate, store.n_features)] = chunk
+            for done, future in enumerate(as_completed(futures), 1):
+                store.add([key for key, _ in futures[future]], future.result())
+                print(f"{done}/{len(chunks)} chunks featurized", file=sys.stderr)
+    return store.get(keys)
+
+
+# Function to get the features of files ready for the LSTM in test1.h5, which takes (n, 40, 1)
+def load_model_inputs(paths, store_directory="feature_store", workers=os.cpu_count()):
+    return np.expand_dims(extract_features(paths, FeatureStore(store_directory), workers), -1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute MFCC features for the Keras emotion model.")
+    parser.add_argument("source", help="directory of recordings or manifest file with one path per line")
+    parser.add_argument("--store", default="feature_store", help="feature store directory")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=32, help="clips per batched STFT")
+    args = parser.parse_args()
+
+    paths = list_audio_files(args.source)
+    store = FeatureStore(args.store)
+    features = extract_features(paths, store, args.workers, args.chunk_size)
+    print(f"{len(features)} files featurized, {len(store)} in the store", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
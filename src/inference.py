@@ -0,0 +1,108 @@
+import os
+import time
+import queue
+import itertools
+import threading
+from concurrent.futures import Future
+
+
+# Runs one model on its own thread, coalescing requests that arrive close together into batches.
+# Requests are served in order of arrival, except that a request with a priority of p seconds
+# is served as if it had arrived p seconds earlier, so urgent calls overtake without starving the rest
+class BatchingWorker:
+    def __init__(self, name, run_batch, max_batch_size=8, max_wait_ms=5, lock=None, threads=None):
+        self.name = name
+        # torch threads of the model, so the core groups running at once do not oversubscribe the cores
+        self.threads = threads
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        # Workers sharing a lock never run at the same time, so they do not fight over the same cores
+        self.lock = lock or threading.Lock()
+        self.requests = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.batches = 0
+        self.items = 0
+        self.thread = threading.Thread(target=self.serve, name=f"blaghk-{name}", daemon=True)
+        self.thread.start()
+
+    # Function to queue one input and get a future for its result
+    def submit(self, item, priority=0.0):
+        future = Future()
+        future.submitted_at = time.perf_counter()
+        future.priority = priority
+        # The sequence number keeps equal keys in order and means items themselves are never compared
+        self.requests.put((future.submitted_at - priority, next(self.sequence), item, future))
+        return future
+
+    def collect(self):
+        batch = [self.requests.get()[2:]]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout)[2:])
+            except queue.Empty:
+                break
+        return batch
+
+    def serve(self):
+        if self.threads:
+            import torch
+            torch.set_num_threads(self.threads)
+        while True:
+            batch = [(item, future) for item, future in self.collect() if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                with self.lock:
+                    results = self.run_batch([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            completed_at = time.perf_counter()
+            for (_, future), result in zip(batch, results):
+                future.completed_at = completed_at
+                future.set_result(result)
+
+    @property
+    def mean_batch_size(self):
+        return self.items / self.batches if self.batches else 0.0
+
+
+# Function to parse core groups written as "stage,stage;stage", one group per ";", into a stage -> group map
+def parse_core_groups(spec):
+    return {stage.strip(): i for i, group in enumerate(spec.split(";")) for stage in group.split(",") if stage.strip()}
+
+
+# One batching worker per model, grouped so that models in the same core group take turns.
+# The groups run at the same time, so each gets an equal share of the cores for its torch threads
+class InferenceServer:
+    def __init__(self, stages, core_groups=None, max_wait_ms=5, threads=None):
+        core_groups = core_groups or {}
+        groups = {name: core_groups.get(name, name) for name in stages}
+        self.threads = threads or max(1, (os.cpu_count() or 1) // max(1, len(set(groups.values()))))
+        locks = {}
+        self.workers = {}
+        for name, (run_batch, max_batch_size) in stages.items():
+            lock = locks.setdefault(groups[name], threading.Lock())
+            self.workers[name] = BatchingWorker(name, run_batch, max_batch_size, max_wait_ms, lock, self.threads)
+
+    # Function to send one input to a stage and get a future for its result
+    def submit(self, stage, item, priority=0.0):
+        return self.workers[stage].submit(item, priority)
+
+    def queue_depth(self, stage):
+        return self.workers[stage].requests.qsize()
+
+    def stats(self):
+        return {
+            name: {"queued": worker.requests.qsize(), "batches": worker.batches,
+                   "mean_batch_size": worker.mean_batch_size}
+            for name, worker in self.workers.items()
+        }
@@ -0,0 +1,196 @@
+import sys
+import json
+import time
+import resource
+import threading
+import functools
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from audio_ingest import SAMPLE_RATE
+
+# Upper bounds in seconds of the wall time histogram buckets
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+
+
+# Function to get the peak resident memory of the process in bytes
+def peak_rss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# Function to get the seconds of audio in a decoded buffer or a list of them, None for anything else
+def audio_seconds(value):
+    if isinstance(value, np.ndarray):
+        return len(value) / SAMPLE_RATE
+    if isinstance(value, (list, tuple)) and value and all(isinstance(v, np.ndarray) for v in value):
+        return sum(len(v) for v in value) / SAMPLE_RATE
+    return None
+
+
+# Counters, histograms and a trace log for every stage of the pipeline
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.collectors = []
+        self.trace_file = None
+
+    # Function to also write every stage and call as one JSON line to a file
+    def open_trace(self, path):
+        self.trace_file = open(path, "a", encoding="utf-8")
+
+    # Function to add gauges computed at scrape time, e.g. queue depths
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def trace(self, record):
+        if self.trace_file is None:
+            return
+        line = json.dumps({"time": time.time(), **record}, ensure_ascii=False)
+        with self.lock:
+            self.trace_file.write(line + "\n")
+            self.trace_file.flush()
+
+    def record(self, stage, wall, cpu, audio, error=False):
+        with self.lock:
+            stats = self.stages.setdefault(stage, {
+                "calls": 0, "errors": 0, "wall": 0.0, "cpu": 0.0, "audio": 0.0, "audio_wall": 0.0,
+                "buckets": [0] * len(BUCKETS),
+            })
+            stats["calls"] += 1
+            stats["errors"] += error
+            stats["wall"] += wall
+            stats["cpu"] += cpu
+            if audio:
+                stats["audio"] += audio
+                stats["audio_wall"] += wall
+            for i, bound in enumerate(BUCKETS):
+                if wall <= bound:
+                    stats["buckets"][i] += 1
+                    break
+        rss = peak_rss()
+        self.trace({
+            "stage": stage,
+            "wall": wall,
+            "cpu": cpu,
+            "audio_seconds": audio,
+            "real_time_factor": wall / audio if audio else None,
+            "peak_rss": rss,
+            "error": error,
+            "thread": threading.current_thread().name,
+        })
+
+    # Function to get the wall seconds every stage has spent running so far
+    def wall_seconds(self):
+        with self.lock:
+            return {stage: stats["wall"] for stage, stats in self.stages.items()}
+
+    # Function to hand over the stage counters recorded so far and start again from zero
+    def take(self):
+        with self.lock:
+            stages, self.stages = self.stages, {}
+        return stages
+
+    # Function to add stage counters taken from another process, e.g. a stage process of sharding.py
+    def merge(self, stages):
+        with self.lock:
+            for stage, other in stages.items():
+                stats = self.stages.setdefault(stage, {key: [0] * len(BUCKETS) if key == "buckets" else 0
+                                                       for key in other})
+                for key, value in other.items():
+                    if key == "buckets":
+                        stats["buckets"] = [a + b for a, b in zip(stats["buckets"], value)]
+                    else:
+                        stats[key] += value
+
+    # Function to measure wall and CPU time of a block. CPU time is the whole process's, as torch does most of
+    # the work on its own threads; stages running at the same time are each counted the CPU time of both
+    @contextmanager
+    def measure(self, stage, audio=None):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - wall_start, time.process_time() - cpu_start, audio, error)
+
+    # Function to decorate a stage function, reading the audio duration from its first argument
+    def instrument(self, stage):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.measure(stage, audio_seconds(args[0]) if args else None):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # Function to render everything in the Prometheus text format
+    def render(self):
+        with self.lock:
+            stages = {stage: {**stats, "buckets": list(stats["buckets"])} for stage, stats in self.stages.items()}
+        lines = [
+            "# HELP blaghk_stage_calls_total Calls of every pipeline stage.",
+            "# TYPE blaghk_stage_calls_total counter",
+        ]
+        lines += [f'blaghk_stage_calls_total{{stage="{s}"}} {v["calls"]}' for s, v in stages.items()]
+        lines += ["# HELP blaghk_stage_errors_total Failed calls of every pipeline stage.",
+                  "# TYPE blaghk_stage_errors_total counter"]
+        lines += [f'blaghk_stage_errors_total{{stage="{s}"}} {v["errors"]}' for s, v in stages.items()]
+        lines += ["# HELP blaghk_stage_cpu_seconds_total Process CPU time while every stage ran, "
+                  "including other stages running at the same time.",
+                  "# TYPE blaghk_stage_cpu_seconds_total counter"]
+        lines += [f'blaghk_stage_cpu_seconds_total{{stage="{s}"}} {v["cpu"]}' for s, v in stages.items()]
+        lines += ["# HELP blaghk_stage_audio_seconds_total Seconds of audio processed by every stage.",
+                  "# TYPE blaghk_stage_audio_seconds_total counter"]
+        lines += [f'blaghk_stage_audio_seconds_total{{stage="{s}"}} {v["audio"]}' for s, v in stages.items()]
+        lines += ["# HELP blaghk_stage_real_time_factor Wall seconds per second of audio.",
+                  "# TYPE blaghk_stage_real_time_factor gauge"]
+        lines += [f'blaghk_stage_real_time_factor{{stage="{s}"}} {v["audio_wall"] / v["audio"]}'
+                  for s, v in stages.items() if v["audio"]]
+        lines += ["# HELP blaghk_stage_wall_seconds Wall time of every stage.",
+                  "# TYPE blaghk_stage_wall_seconds histogram"]
+        for stage, stats in stages.items():
+            cumulative = 0
+            for bound, count in zip(BUCKETS, stats["buckets"]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else bound
+                lines.append(f'blaghk_stage_wall_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'blaghk_stage_wall_seconds_sum{{stage="{stage}"}} {stats["wall"]}')
+            lines.append(f'blaghk_stage_wall_seconds_count{{stage="{stage}"}} {stats["calls"]}')
+        lines += ["# HELP blaghk_process_peak_rss_bytes Peak resident memory of the process.",
+                  "# TYPE blaghk_process_peak_rss_bytes gauge",
+                  f"blaghk_process_peak_rss_bytes {peak_rss()}"]
+        for collector in self.collectors:
+            for name, value in collector().items():
+                lines.append(f"blaghk_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Function to serve /metrics over HTTP on a background thread
+def start_metrics_server(metrics, port, host="0.0.0.0"):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="blaghk-metrics", daemon=True).start()
+    return server
@@ -0,0 +1,75 @@
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+# Loads every model on its own background thread and hands each one out as soon as it is ready
+class ModelRegistry:
+    def __init__(self, loaders):
+        self.loaders = dict(loaders)
+        self.lock = threading.Lock()
+        self.futures = {}
+        self.load_times = {}
+        self.executor = ThreadPoolExecutor(max_workers=max(1, len(self.loaders)), thread_name_prefix="blaghk-load")
+
+    # Function to start loading every model in parallel
+    def start(self):
+        for name in self.loaders:
+            self.load(name)
+        return self
+
+    # Function to start loading one model unless it is already loading
+    def load(self, name):
+        with self.lock:
+            if name not in self.futures:
+                self.futures[name] = self.executor.submit(self.timed_load, name)
+            return self.futures[name]
+
+    # Function to load one model on the calling thread instead of a background one, unless it is already loading
+    def load_now(self, name):
+        with self.lock:
+            future = self.futures.get(name)
+            if future is None:
+                future = self.futures[name] = Future()
+                future.set_running_or_notify_cancel()
+                load = True
+            else:
+                load = False
+        if load:
+            try:
+                future.set_result(self.timed_load(name))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+    def timed_load(self, name):
+        start = time.perf_counter()
+        model = self.loaders[name]()
+        self.load_times[name] = time.perf_counter() - start
+        return model
+
+    # Function to get a model, waiting only for that one to finish loading
+    def get(self, name, timeout=None):
+        return self.load(name).result(timeout)
+
+    def ready(self, name):
+        future = self.futures.get(name)
+        return future is not None and future.done() and future.exception() is None
+
+    # Function to report whether every model is loading, ready or failed
+    def status(self):
+        status = {}
+        for name in self.loaders:
+            future = self.futures.get(name)
+            if future is None:
+                status[name] = "not loaded"
+            elif not future.done():
+                status[name] = "loading"
+            elif future.exception() is not None:
+                status[name] = f"failed: {future.exception()}"
+            else:
+                status[name] = "ready"
+        return status
+
+    def all_ready(self):
+        return all(self.ready(name) for name in self.loaders)
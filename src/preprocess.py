@@ -0,0 +1,151 @@
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import librosa
+from skimage.transform import resize
+
+try:
+    from tensorflow.keras.utils import Sequence
+except ImportError:
+    # Only training needs Keras, preprocessing a dataset does not
+    Sequence = None
+
+CLASSES = ["Civil", "Police", "Trafic", "ambulance"]
+TARGET_SHAPE = (128, 128)
+
+
+# Function to list the wav files of every class folder, as the notebooks did
+def list_dataset(data_dir, classes=CLASSES):
+    paths, labels = [], []
+    for i, class_name in enumerate(classes):
+        class_dir = os.path.join(data_dir, class_name)
+        for filename in sorted(os.listdir(class_dir)):
+            if filename.endswith(".wav"):
+                paths.append(os.path.join(class_dir, filename))
+                labels.append(i)
+    return paths, np.array(labels, dtype=np.int64)
+
+
+# Function to turn audio into the resized mel spectrogram the models take
+def mel_features(audio_data, sample_rate, target_shape=TARGET_SHAPE):
+    mel_spectrogram = librosa.feature.melspectrogram(y=audio_data, sr=sample_rate)
+    return resize(mel_spectrogram, target_shape).astype(np.float32)
+
+
+# Function to load one file and compute its features, run in a worker process
+def preprocess_file(index, file_path, target_shape=TARGET_SHAPE):
+    audio_data, sample_rate = librosa.load(file_path, sr=None)
+    return index, audio_data, sample_rate, mel_features(audio_data, sample_rate, target_shape)
+
+
+# Function to preprocess a dataset on all cores straight into preallocated arrays on disk
+def build_dataset(data_dir, output_dir, classes=CLASSES, target_shape=TARGET_SHAPE, workers=os.cpu_count()):
+    paths, labels = list_dataset(data_dir, classes)
+    os.makedirs(output_dir, exist_ok=True)
+    mels = np.lib.format.open_memmap(os.path.join(output_dir, "mels.npy"), mode="w+", dtype=np.float32,
+                                     shape=(len(paths), *target_shape))
+    # The decoded audio is kept so augmentations can be computed per epoch without decoding again
+    audio_starts = np.zeros(len(paths), dtype=np.int64)
+    audio_lengths = np.zeros(len(paths), dtype=np.int64)
+    sample_rates = np.zeros(len(paths), dtype=np.int64)
+
+    with open(os.path.join(output_dir, "audio.f32"), "wb") as audio_file, \
+            ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(preprocess_file, i, path, target_shape) for i, path in enumerate(paths)]
+        for done, future in enumerate(as_completed(futures), 1):
+            i, audio_data, sample_rate, mel = future.result()
+            mels[i] = mel
+            audio_starts[i] = audio_file.tell() // 4
+            audio_lengths[i] = len(audio_data)
+            sample_rates[i] = sample_rate
+            audio_file.write(audio_data.astype(np.float32).tobytes())
+            if done % 100 == 0 or done == len(paths):
+                print(f"{done}/{len(paths)} files preprocessed", file=sys.stderr)
+
+    mels.flush()
+    np.save(os.path.join(output_dir, "labels.npy"), labels)
+    np.savez(os.path.join(output_dir, "audio_index.npz"), starts=audio_starts, lengths=audio_lengths,
+             sample_rates=sample_rates)
+    with open(os.path.join(output_dir, "dataset.json"), "w") as f:
+        json.dump({"classes": classes, "target_shape": list(target_shape), "paths": paths}, f, ensure_ascii=False)
+    return output_dir
+
+
+# Function to open a preprocessed dataset without reading it into memory
+def load_dataset(output_dir):
+    with open(os.path.join(output_dir, "dataset.json")) as f:
+        info = json.load(f)
+    mels = np.load(os.path.join(output_dir, "mels.npy"), mmap_mode="r")
+    labels = np.load(os.path.join(output_dir, "labels.npy"))
+    return mels, labels, info
+
+
+# Feeds a preprocessed dataset to Keras, computing pitch-shift and time-stretch augmentations per epoch
+class AugmentedSequence(Sequence or object):
+    def __init__(self, output_dir, indices=None, batch_size=32, augment_probability=0.5, n_steps=4, rate=1.5,
+                 shuffle=True, seed=None, **kwargs):
+        if Sequence is None:
+            raise ImportError("AugmentedSequence feeds Keras models and needs tensorflow (pip install tensorflow)")
+        super().__init__(**kwargs)
+        self.mels, labels, info = load_dataset(output_dir)
+        self.n_classes = len(info["classes"])
+        self.one_hot = np.eye(self.n_classes, dtype=np.float32)[labels]
+        self.target_shape = tuple(info["target_shape"])
+        audio_index = np.load(os.path.join(output_dir, "audio_index.npz"))
+        self.audio_starts = audio_index["starts"]
+        self.audio_lengths = audio_index["lengths"]
+        self.sample_rates = audio_index["sample_rates"]
+        self.audio = np.memmap(os.path.join(output_dir, "audio.f32"), dtype=np.float32, mode="r")
+        self.indices = np.arange(len(labels)) if indices is None else np.asarray(indices)
+        self.batch_size = batch_size
+        self.augment_probability = augment_probability
+        self.n_steps = n_steps
+        self.rate = rate
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        self.on_epoch_end()
+
+    def __len__(self):
+        return int(np.ceil(len(self.indices) / self.batch_size))
+
+    def augmented(self, i):
+        start = self.audio_starts[i]
+        audio_data = np.array(self.audio[start:start + self.audio_lengths[i]])
+        sample_rate = int(self.sample_rates[i])
+        if self.rng.random() < 0.5:
+            audio_data = librosa.effects.pitch_shift(audio_data, sr=sample_rate, n_steps=self.n_steps)
+        else:
+            audio_data = librosa.effects.time_stretch(audio_data, rate=self.rate)
+        return mel_features(audio_data, sample_rate, self.target_shape)
+
+    def __getitem__(self, batch):
+        batch_indices = self.order[batch * self.batch_size:(batch + 1) * self.batch_size]
+        x = np.empty((len(batch_indices), *self.target_shape), dtype=np.float32)
+        for j, i in enumerate(batch_indices):
+            if self.augment_probability and self.rng.random() < self.augment_probability:
+                x[j] = self.augmented(i)
+            else:
+                x[j] = self.mels[i]
+        return x, self.one_hot[batch_indices]
+
+    def on_epoch_end(self):
+        self.order = self.rng.permutation(self.indices) if self.shuffle else self.indices
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preprocess a folder of class sub-folders into mel spectrograms.")
+    parser.add_argument("data_dir", help="folder with one sub-folder of wav files per class")
+    parser.add_argument("-o", "--output", default="dataset", help="output folder")
+    parser.add_argument("--classes", nargs="+", default=CLASSES)
+    parser.add_argument("--target-shape", nargs=2, type=int, default=list(TARGET_SHAPE))
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    build_dataset(args.data_dir, args.output, args.classes, tuple(args.target_shape), args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import os
+import gc
+import sys
+import json
+import time
+import argparse
+
+import pandas as pd
+
+# This script loads every profile itself, so blaghk.py must not preload its own copy
+os.environ["BLAGHK_PRELOAD"] = "0"
+
+from audio_ingest import load_audio
+from blaghk import (load_whisper, load_classifier, load_emotion_classifier, transcribe,
+                    classify_transcripts_zero_shot, classify_emotion_timelines)
+from profiles import PROFILES
+
+
+# Function to count word-level edits between two transcripts
+def word_errors(reference, hypothesis):
+    reference, hypothesis = reference.split(), hypothesis.split()
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word)))
+        previous = current
+    return previous[-1]
+
+
+# Function to run the three models of one profile over the labelled calls
+def run_profile(profile, audios):
+    start = time.perf_counter()
+    whisper_model = load_whisper(profile)
+    zero_shot_classifier = load_classifier(profile)
+    emotion_classifier = load_emotion_classifier(profile)
+    load_time = time.perf_counter() - start
+
+    seconds = {"transcribe": 0.0, "classify_transcript": 0.0, "classify_emotion": 0.0}
+    texts, departments, emotions = [], [], []
+    for audio in audios:
+        start = time.perf_counter()
+        texts.append(transcribe(audio, model=whisper_model)["text"])
+        seconds["transcribe"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        departments.append(classify_transcripts_zero_shot([texts[-1]], zero_shot_classifier)[0]["labels"][0])
+        seconds["classify_transcript"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        emotion_result = classify_emotion_timelines([audio], emotion_classifier=emotion_classifier)[0]
+        emotions.append(emotion_result["distribution"][0]["label"])
+        seconds["classify_emotion"] += time.perf_counter() - start
+
+    del whisper_model, zero_shot_classifier, emotion_classifier
+    gc.collect()
+    return {"load_time": load_time, "seconds": seconds, "texts": texts, "departments": departments,
+            "emotions": emotions}
+
+
+# Function to compare one profile's outputs with fp32 and with the labels
+def drift_report(profile, result, baseline, labels):
+    n = len(result["texts"])
+    reference_words = sum(len(t.split()) for t in baseline["texts"]) or 1
+    report = {
+        "profile": profile,
+        "load_time": result["load_time"],
+        "wer_vs_fp32": sum(word_errors(r, h) for r, h in zip(baseline["texts"], result["texts"])) / reference_words,
+        "department_agreement_vs_fp32": sum(a == b for a, b in zip(baseline["departments"], result["departments"])) / n,
+        "emotion_agreement_vs_fp32": sum(a == b for a, b in zip(baseline["emotions"], result["emotions"])) / n,
+    }
+    for stage, seconds in result["seconds"].items():
+        report[f"{stage}_seconds_per_call"] = seconds / n
+        report[f"{stage}_speedup"] = baseline["seconds"][stage] / seconds if seconds else 0.0
+    for column in ("department", "emotion"):
+        if column in labels:
+            report[f"{column}_accuracy"] = sum(a == b for a, b in zip(labels[column], result[f"{column}s"])) / n
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report accuracy drift and speed of inference profiles vs fp32.")
+    parser.add_argument("csv", help="labelled calls with a path column and optional department/emotion columns")
+    parser.add_argument("--profiles", nargs="+", default=["int8", "onnx"], choices=[p for p in PROFILES if p != "fp32"])
+    parser.add_argument("-o", "--output", help="also write the report as JSON")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.csv)
+    labels = {column: df[column].tolist() for column in ("department", "emotion") if column in df}
+    audios = [load_audio(path) for path in df["path"]]
+
+    baseline = run_profile("fp32", audios)
+    reports = [drift_report("fp32", baseline, baseline, labels)]
+    for profile in args.profiles:
+        print(f"running {profile}", file=sys.stderr)
+        reports.append(drift_report(profile, run_profile(profile, audios), baseline, labels))
+
+    print(pd.DataFrame(reports).set_index("profile").T.to_string(float_format="{:.3f}".format))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import os
+
+import torch
+from transformers import pipeline
+
+# fp32 is the default PyTorch model, int8 quantizes every Linear layer, onnx runs the model in ONNX Runtime
+PROFILES = ("fp32", "int8", "onnx")
+PROFILE = os.environ.get("BLAGHK_PROFILE", "fp32")
+
+ORT_MODEL_CLASSES = {
+    "zero-shot-classification": "ORTModelForSequenceClassification",
+    "audio-classification": "ORTModelForAudioClassification",
+}
+
+
+def check_profile(profile):
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown inference profile {profile!r}, expected one of {', '.join(PROFILES)}")
+
+
+# Function to quantize the weights of every Linear layer to int8, activations are quantized on the fly
+def quantize_int8(model):
+    for module in model.modules():
+        # Subclasses such as whisper's Linear are not picked up by quantize_dynamic, and on a CPU
+        # in fp32 they behave exactly like a plain Linear
+        if isinstance(module, torch.nn.Linear) and type(module) is not torch.nn.Linear:
+            module.__class__ = torch.nn.Linear
+    return torch.ao.quantization.quantize_dynamic(model.eval(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+# Function to apply an inference profile to an openai-whisper model
+def apply_whisper_profile(model, profile=PROFILE):
+    check_profile(profile)
+    if profile == "fp32":
+        return model
+    # openai-whisper has no ONNX Runtime backend, so the onnx profile uses int8 for Whisper
+    return quantize_int8(model)
+
+
+# Function to load a transformers pipeline with an inference profile
+def load_pipeline(task, model_name, profile=PROFILE):
+    check_profile(profile)
+    if profile == "onnx":
+        import optimum.onnxruntime
+        ort_model = getattr(optimum.onnxruntime, ORT_MODEL_CLASSES[task]).from_pretrained(model_name, export=True)
+        if task == "audio-classification":
+            return pipeline(task, model=ort_model, feature_extractor=model_name)
+        return pipeline(task, model=ort_model, tokenizer=model_name)
+    classifier = pipeline(task, model=model_name)
+    if profile == "int8":
+        classifier.model = quantize_int8(classifier.model)
+    return classifier
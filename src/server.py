@@ -0,0 +1,251 @@
+import os
+import json
+import uuid
+import asyncio
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+
+from audio_ingest import AudioUpload
+from blaghk import metrics, models, run_pipeline
+
+# Calls waiting for a pipeline worker; uploads beyond this are refused with 429 instead of piling up in memory
+QUEUE_SIZE = int(os.environ.get("BLAGHK_SERVER_QUEUE_SIZE", "32"))
+# Calls going through the pipeline at once, each on its own thread so the event loop never waits on a model
+PIPELINE_WORKERS = int(os.environ.get("BLAGHK_SERVER_WORKERS", "4"))
+# Live calls streamed to /live at once, each with a thread of its own so it never waits for a pipeline worker
+LIVE_CALLS = int(os.environ.get("BLAGHK_SERVER_LIVE_CALLS", "8"))
+MAX_UPLOAD_MB = float(os.environ.get("BLAGHK_SERVER_MAX_UPLOAD_MB", "50"))
+# Finished jobs kept for clients that fetch their result late
+JOB_HISTORY = int(os.environ.get("BLAGHK_SERVER_JOB_HISTORY", "1000"))
+
+app = FastAPI(title="Blaghk")
+
+
+# One uploaded call and every stage result sent back for it so far
+class Job:
+    def __init__(self, audio_upload):
+        self.id = uuid.uuid4().hex
+        self.audio_upload = audio_upload
+        self.status = "queued"
+        self.events = []
+        self.changed = asyncio.Event()
+
+    def add_event(self, stage, data):
+        self.events.append((stage, data))
+        # Wake every client streaming this job, then wait for the next event
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def finish(self, status, stage, data):
+        self.status = status
+        self.add_event(stage, data)
+
+    @property
+    def done(self):
+        return self.status in ("done", "failed")
+
+
+jobs = OrderedDict()
+
+
+# Function to forget the oldest finished jobs once there are too many
+def prune_jobs():
+    for job_id in list(jobs):
+        if len(jobs) <= JOB_HISTORY:
+            return
+        if jobs[job_id].done:
+            del jobs[job_id]
+
+
+# Function to run the pipeline of every queued call on a worker thread, sending stage results back to the loop
+async def pipeline_worker(queue, executor):
+    loop = asyncio.get_running_loop()
+    while True:
+        job = await queue.get()
+        job.status = "running"
+
+        def on_stage(stage, data, job=job):
+            loop.call_soon_threadsafe(job.add_event, stage, data)
+
+        try:
+            result = await loop.run_in_executor(executor, run_pipeline, job.audio_upload, on_stage)
+            job.finish("done", "result", result)
+        except Exception as e:
+            job.finish("failed", "error", {"error": str(e)})
+        finally:
+            # The audio is not needed once the call went through
+            job.audio_upload = None
+            queue.task_done()
+
+
+@app.on_event("startup")
+async def start_workers():
+    app.state.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    app.state.executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="blaghk-server")
+    app.state.workers = [asyncio.create_task(pipeline_worker(app.state.queue, app.state.executor))
+                         for _ in range(PIPELINE_WORKERS)]
+    app.state.live_executor = ThreadPoolExecutor(max_workers=LIVE_CALLS, thread_name_prefix="blaghk-live")
+    app.state.live_calls = 0
+
+
+@app.on_event("shutdown")
+async def stop_workers():
+    for worker in app.state.workers:
+        worker.cancel()
+    app.state.executor.shutdown(wait=False, cancel_futures=True)
+    app.state.live_executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Function to read a request body chunk by chunk, refusing it as soon as it is too large
+async def read_body(stream):
+    max_bytes = int(MAX_UPLOAD_MB * 1024 * 1024)
+    chunks = []
+    size = 0
+    async for chunk in stream:
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(413, f"Recordings are limited to {MAX_UPLOAD_MB:g} MB")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+# Function to get the upload of a multipart form (field "audio") or of a raw, possibly chunked, body
+async def read_upload(request, file_format):
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_MB * 1024 * 1024:
+        raise HTTPException(413, f"Recordings are limited to {MAX_UPLOAD_MB:g} MB")
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        # Starlette parses the whole form, spooling large files to disk, before the size can be checked
+        # here, so a chunked multipart upload is only refused once it has been received
+        form = await request.form()
+        audio_file = form.get("audio")
+        if audio_file is None:
+            raise HTTPException(400, "The form has no audio field")
+
+        async def file_chunks():
+            while chunk := await audio_file.read(1024 * 1024):
+                yield chunk
+
+        audio_bytes = await read_body(file_chunks())
+        file_format = file_format or os.path.splitext(audio_file.filename or "")[1][1:] or "wav"
+    else:
+        audio_bytes = await read_body(request.stream())
+        content_type = request.headers.get("content-type", "")
+        file_format = file_format or (content_type.split("/")[1] if content_type.startswith("audio/") else "wav")
+    if not audio_bytes:
+        raise HTTPException(400, "The recording is empty")
+    return AudioUpload(audio_bytes, file_format)
+
+
+# Accept a recording and queue it; the client gets a job id straight away, before any model runs
+@app.post("/calls", status_code=202)
+async def submit_call(request: Request, format: str = None):
+    queue = app.state.queue
+    # Refuse before reading the body when there is no room anyway
+    if queue.full():
+        raise HTTPException(429, "Too many calls waiting", headers={"Retry-After": "5"})
+    job = Job(await read_upload(request, format))
+    try:
+        queue.put_nowait(job)
+    except asyncio.QueueFull:
+        raise HTTPException(429, "Too many calls waiting", headers={"Retry-After": "5"})
+    jobs[job.id] = job
+    prune_jobs()
+    return {"job_id": job.id, "status": job.status, "queued": queue.qsize()}
+
+
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Unknown job")
+    return job
+
+
+@app.get("/calls/{job_id}")
+async def call_status(job_id: str):
+    job = get_job(job_id)
+    return {"job_id": job.id, "status": job.status, "stages": {stage: data for stage, data in job.events}}
+
+
+# Stream the result of every stage as a server-sent event as soon as it is done
+@app.get("/calls/{job_id}/events")
+async def call_events(job_id: str):
+    job = get_job(job_id)
+
+    async def events():
+        sent = 0
+        while True:
+            changed = job.changed
+            while sent < len(job.events):
+                stage, data = job.events[sent]
+                sent += 1
+                yield f"event: {stage}\ndata: {json.dumps(data, ensure_ascii=False, default=float)}\n\n"
+            if job.done:
+                return
+            await changed.wait()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+# Transcribe a call while it is going on: the body is the call's 16 kHz mono 16-bit PCM, sent chunked as it is
+# recorded, and a JSON line with the transcript and provisional department comes back after every segment
+@app.post("/live")
+async def live_call(request: Request):
+    from streaming import StreamingTranscriber
+
+    if app.state.live_calls >= LIVE_CALLS:
+        raise HTTPException(429, "Too many live calls", headers={"Retry-After": "5"})
+    loop = asyncio.get_running_loop()
+    executor = app.state.live_executor
+    transcriber = StreamingTranscriber()
+    app.state.live_calls += 1
+
+    async def partials():
+        try:
+            leftover = b""
+            async for chunk in request.stream():
+                # A chunk may end halfway through a sample
+                chunk = leftover + chunk
+                usable = len(chunk) - len(chunk) % 2
+                leftover = chunk[usable:]
+                for partial in await loop.run_in_executor(executor, transcriber.feed, chunk[:usable]):
+                    yield json.dumps(partial, ensure_ascii=False, default=float) + "\n"
+            for partial in await loop.run_in_executor(executor, transcriber.finish):
+                yield json.dumps(partial, ensure_ascii=False, default=float) + "\n"
+            final = {"text": transcriber.text, "decision": transcriber.decision, "routed_at": transcriber.routed_at}
+            yield json.dumps(final, ensure_ascii=False, default=float) + "\n"
+        finally:
+            # Also reached when the switch hangs up without finishing the body
+            app.state.live_calls -= 1
+
+    return StreamingResponse(partials(), media_type="application/x-ndjson")
+
+
+@app.get("/health")
+async def health():
+    return {"models": models.status(), "queued": app.state.queue.qsize(), "queue_size": QUEUE_SIZE,
+            "live_calls": app.state.live_calls, "max_live_calls": LIVE_CALLS}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return metrics.render()
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve the triage pipeline over HTTP.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    # One process: the models, workers and jobs all live in memory
+    uvicorn.run(app, host=args.host, port=args.port, workers=1)
+
+
+if __name__ == "__main__":
+    main()
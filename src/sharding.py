@@ -0,0 +1,73 @@
+import os
+import gc
+import threading
+import traceback
+import multiprocessing
+
+import torch
+
+
+# Function run in a stage's process: takes batches from the pipe and sends back results or the error,
+# together with the report of what the batch changed in the process, e.g. the metrics it recorded
+def serve_shard(run_batch, connection, threads, report):
+    torch.set_num_threads(threads)
+    # Whatever the parent had recorded before the fork was copied here too and must not be reported twice
+    if report:
+        report()
+    while True:
+        try:
+            items, options = connection.recv()
+        except EOFError:
+            return
+        try:
+            results = run_batch(items, **options)
+            connection.send((True, results, report() if report else None))
+        except Exception:
+            connection.send((False, traceback.format_exc(), report() if report else None))
+
+
+# Runs the batch function of one stage in a forked process, called like the function itself.
+# State that only the parent knows, like queue depths, is passed along by the options function; state that only
+# the child knows, like metrics, comes back from the report function in the child to on_report in the parent
+class ProcessShard:
+    def __init__(self, name, run_batch, threads, options=None, report=None, on_report=None):
+        context = multiprocessing.get_context("fork")
+        self.name = name
+        self.options = options
+        self.on_report = on_report
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=serve_shard, args=(run_batch, child_connection, threads, report),
+                                       name=f"blaghk-{name}", daemon=True)
+        self.process.start()
+        child_connection.close()
+        # The pipe carries one batch at a time
+        self.lock = threading.Lock()
+
+    def __call__(self, items):
+        with self.lock:
+            self.connection.send((items, self.options() if self.options else {}))
+            ok, payload, report = self.connection.recv()
+        if report is not None and self.on_report:
+            self.on_report(report)
+        if not ok:
+            raise RuntimeError(f"{self.name} worker failed:\n{payload}")
+        return payload
+
+
+# Function to load every model once and fork one process per stage, which all read the same weights.
+# Forked processes share the parent's memory until a page is written, and inference never writes to weights;
+# freezing the garbage collector keeps it from writing to every inherited object and so copying its page.
+# The loaders must run on the calling thread: loading runs with a single torch thread, so no thread pool exists to
+# be broken by the fork, and every stage process then sizes its own pool
+def shard_stages(stages, loaders, options=None, threads=None, reports=None, on_report=None):
+    torch.set_num_threads(1)
+    for load in loaders:
+        load()
+    threads = threads or max(1, os.cpu_count() // len(stages))
+    gc.collect()
+    gc.freeze()
+    options = options or {}
+    reports = reports or {}
+    return {name: (ProcessShard(name, run_batch, threads, options.get(name), reports.get(name), on_report),
+                   max_batch_size)
+            for name, (run_batch, max_batch_size) in stages.items()}
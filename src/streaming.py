@@ -0,0 +1,238 @@
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from audio_ingest import SAMPLE_RATE, load_audio
+from blaghk import classify_transcripts, inference_server
+from distress import spot_keywords
+from vad import SpeechSegmenter
+
+# Temperature fitted by calibrate_router on held-out labelled calls, used by every router unless given another
+ROUTER_CALIBRATION_PATH = os.environ.get("BLAGHK_ROUTER_CALIBRATION", "router_calibration.json")
+
+
+# Function to sharpen or soften classifier scores with a temperature fitted on labelled calls (see calibrate_router)
+def calibrate(classification_result, temperature=1.0):
+    scores = np.asarray(classification_result["scores"], dtype=np.float64) ** (1.0 / temperature)
+    scores = scores / scores.sum()
+    order = np.argsort(-scores)
+    return {
+        "labels": [classification_result["labels"][i] for i in order],
+        "scores": [float(scores[i]) for i in order],
+    }
+
+
+# Function to get the fitted router temperature, 1.0 (scores as they are) if none was fitted
+def load_temperature(path=ROUTER_CALIBRATION_PATH):
+    if not os.path.exists(path):
+        return 1.0
+    with open(path) as f:
+        return json.load(f)["temperature"]
+
+
+# Function to get the mean negative log-likelihood of the true departments under a temperature
+def calibration_loss(classification_results, labels, temperature):
+    losses = []
+    for classification_result, label in zip(classification_results, labels):
+        calibrated = calibrate(classification_result, temperature)
+        scores = dict(zip(calibrated["labels"], calibrated["scores"]))
+        losses.append(-np.log(max(scores.get(label, 0.0), 1e-12)))
+    return float(np.mean(losses))
+
+
+# Function to find the temperature that makes the scores match how often the top department is right
+def fit_temperature(classification_results, labels, temperatures=np.geomspace(0.1, 10.0, 81)):
+    losses = [calibration_loss(classification_results, labels, t) for t in temperatures]
+    return float(temperatures[int(np.argmin(losses))])
+
+
+# Function to fit the router temperature on labelled transcripts the fast classifier was not trained on.
+# The router sees partial transcripts, so every call is classified from its first quarter, half, three quarters
+# and whole text
+def calibrate_router(csv_path, output_path=ROUTER_CALIBRATION_PATH, text_column="transcription",
+                     label_column="department", fractions=(0.25, 0.5, 0.75, 1.0)):
+    df = pd.read_csv(csv_path).dropna(subset=[text_column, label_column])
+    texts, labels = [], []
+    for text, label in zip(df[text_column], df[label_column]):
+        words = text.split()
+        for fraction in fractions:
+            prefix = " ".join(words[:max(1, round(len(words) * fraction))])
+            texts.append(prefix)
+            labels.append(label)
+    classification_results = classify_transcripts(texts)
+    temperature = fit_temperature(classification_results, labels)
+    calibration = {
+        "temperature": temperature,
+        "calls": len(df),
+        "loss_before": calibration_loss(classification_results, labels, 1.0),
+        "loss_after": calibration_loss(classification_results, labels, temperature),
+    }
+    with open(output_path, "w") as f:
+        json.dump(calibration, f, indent=2)
+    return calibration
+
+
+# Decides the department once the top label is confident and stable across updates
+class EarlyExitRouter:
+    def __init__(self, threshold=0.8, patience=2, temperature=None):
+        self.threshold = threshold
+        self.patience = patience
+        self.temperature = load_temperature() if temperature is None else temperature
+        self.streak_label = None
+        self.streak = 0
+        self.decision = None
+
+    # Function to add a new classification and return the decision once it is made
+    def update(self, classification_result):
+        if self.decision is not None:
+            return self.decision
+        calibrated = calibrate(classification_result, self.temperature)
+        label, score = calibrated["labels"][0], calibrated["scores"][0]
+        if score < self.threshold:
+            self.streak_label, self.streak = None, 0
+            return None
+        if label == self.streak_label:
+            self.streak += 1
+        else:
+            self.streak_label, self.streak = label, 1
+        if self.streak >= self.patience:
+            self.decision = {"label": label, "score": score}
+        return self.decision
+
+
+# Transcribes a live call segment by segment and re-routes it after every segment
+class StreamingTranscriber:
+    def __init__(self, segmenter=None, router=None):
+        self.segmenter = segmenter or SpeechSegmenter()
+        self.router = router or EarlyExitRouter()
+        self.started = time.perf_counter()
+        self.segments = []
+        self.language = None
+        self.routed_at = None
+        # Once routed, the rest of the call is transcribed here without holding up the caller
+        self.background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="blaghk-stream")
+        self.background_jobs = []
+
+    @property
+    def text(self):
+        return " ".join(segment["text"] for segment in self.segments).strip()
+
+    @property
+    def decision(self):
+        return self.router.decision
+
+    # Function to feed a chunk from the recorder (float32 samples or 16-bit PCM bytes) and get new partials
+    def feed(self, chunk):
+        partials = []
+        for segment in self.segmenter.feed(chunk):
+            partial = self.process(segment)
+            if partial:
+                partials.append(partial)
+        return partials
+
+    # Function to transcribe what is left once the caller hangs up and wait for the full transcript
+    def finish(self):
+        segment = self.segmenter.flush()
+        partial = self.process(segment) if segment else None
+        for job in self.background_jobs:
+            job.result()
+        self.background.shutdown()
+        return [partial] if partial else []
+
+    # Function to transcribe a segment on the shared Whisper worker, which never runs two decodes on a model at once
+    def transcribe_segment(self, segment):
+        start, end, audio = segment
+        # The language of the first segment is kept for the rest of the call, and the previous text keeps names
+        # and spelling consistent across segments
+        result = inference_server.submit("transcribe_segment", {
+            "audio": audio, "language": self.language, "initial_prompt": self.text or None,
+        }).result()
+        self.language = self.language or result["language"]
+        self.segments.append({"start": start, "end": end, "text": result["text"].strip()})
+        return result
+
+    def process(self, segment):
+        if self.decision is not None:
+            # Routing is settled, so the remaining segments only matter for the full transcript
+            self.background_jobs.append(self.background.submit(self.transcribe_segment, segment))
+            return None
+
+        start, end, _ = segment
+        result = self.transcribe_segment(segment)
+        text = self.text
+        classification_result = inference_server.submit("classify_transcript", text).result() if text else None
+        if classification_result and self.router.update(classification_result):
+            self.routed_at = time.perf_counter() - self.started
+        return {
+            "start": start,
+            "end": end,
+            "segment_text": result["text"].strip(),
+            "text": text,
+            "language": result.get("language"),
+            "classification": classification_result,
+            "keywords": spot_keywords(text),
+            "decision": self.decision,
+            "elapsed": time.perf_counter() - self.started,
+        }
+
+
+# Function to replay a recording as a live stream of fixed-size chunks
+def stream_chunks(audio_source, chunk_seconds=0.5):
+    audio = load_audio(audio_source)
+    chunk_length = int(chunk_seconds * SAMPLE_RATE)
+    for i in range(0, len(audio), chunk_length):
+        yield audio[i:i + chunk_length]
+
+
+# Function to print one partial result
+def print_partial(partial):
+    department = partial["classification"]["labels"][0] if partial["classification"] else "-"
+    routed = " (routed)" if partial["decision"] else ""
+    keywords = f" [{', '.join(partial['keywords'])}]" if partial["keywords"] else ""
+    print(f"[{partial['start']:6.1f}s-{partial['end']:6.1f}s] {department}{routed}{keywords}: {partial['segment_text']}",
+          file=sys.stderr)
+
+
+# Function to print the provisional department after every segment of a recording
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe a recording as if it were a live call.")
+    parser.add_argument("audio", nargs="?", help="recording to replay")
+    parser.add_argument("--chunk-seconds", type=float, default=0.5)
+    parser.add_argument("--threshold", type=float, default=0.8,
+                        help="department score needed to stop re-routing")
+    parser.add_argument("--patience", type=int, default=2,
+                        help="number of updates the top department must stay above the threshold")
+    parser.add_argument("--temperature", type=float, default=None,
+                        help=f"calibration temperature, by default the one fitted in {ROUTER_CALIBRATION_PATH}")
+    parser.add_argument("--calibrate", metavar="CSV",
+                        help="fit the temperature on held-out labelled transcripts (see train_classifier.py "
+                             "--holdout-output) instead of replaying a recording")
+    args = parser.parse_args()
+
+    if args.calibrate:
+        calibration = calibrate_router(args.calibrate)
+        print(f"temperature {calibration['temperature']:.2f}, loss {calibration['loss_before']:.3f} -> "
+              f"{calibration['loss_after']:.3f} on {calibration['calls']} calls", file=sys.stderr)
+        return
+    if not args.audio:
+        parser.error("a recording to replay is needed")
+
+    transcriber = StreamingTranscriber(router=EarlyExitRouter(args.threshold, args.patience, args.temperature))
+    for chunk in stream_chunks(args.audio, args.chunk_seconds):
+        for partial in transcriber.feed(chunk):
+            print_partial(partial)
+    for partial in transcriber.finish():
+        print_partial(partial)
+    if transcriber.decision:
+        print(f"routed to {transcriber.decision['label']} after {transcriber.routed_at:.1f}s", file=sys.stderr)
+    print(transcriber.text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import json
+import argparse
+
+import joblib
+import pandas as pd
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics import classification_report
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import make_pipeline
+from sklearn.svm import LinearSVC
+
+# The departments blaghk.py shows, keyed by the folder names the notebooks use as classes in df.csv
+FOLDER_DEPARTMENTS = {"Civil": "الدفاع المدني", "Trafic": "المرور", "ambulance": "الاسعاف", "Police": "الشرطة"}
+
+
+# Function to turn the labels of a dataset into the department names the zero-shot classifier returns,
+# so both classifiers of blaghk.py label the same department the same way
+def map_labels(labels, label_map=FOLDER_DEPARTMENTS):
+    departments = labels.map(lambda label: label_map.get(label, label))
+    unknown = set(departments) - set(label_map.values())
+    if unknown:
+        raise ValueError(f"Labels {sorted(unknown)} are not departments, add them to the label map")
+    return departments
+
+
+# Function to build the TF-IDF + LinearSVC department classifier
+def build_classifier():
+    return make_pipeline(
+        # Character n-grams cope with Arabic prefixes and suffixes better than whole words
+        TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 5), sublinear_tf=True),
+        # Calibration turns the SVM margins into probabilities for the zero-shot fallback threshold
+        CalibratedClassifierCV(LinearSVC(), cv=3),
+    )
+
+
+# Function to train the classifier on labelled transcripts and save it for blaghk.py
+def train(csv_path, output_path, text_column="transcription", label_column="classes", test_size=0.2,
+          label_map=FOLDER_DEPARTMENTS, holdout_path=None):
+    df = pd.read_csv(csv_path).dropna(subset=[text_column, label_column])
+    df[label_column] = map_labels(df[label_column], label_map)
+    X_train, X_test, y_train, y_test = train_test_split(
+        df[text_column], df[label_column], test_size=test_size, stratify=df[label_column], random_state=42
+    )
+    classifier = build_classifier()
+    classifier.fit(X_train, y_train)
+    print(classification_report(y_test, classifier.predict(X_test)))
+    # Calls the saved model never sees, to fit the early-exit router's temperature on (streaming.py --calibrate)
+    if holdout_path:
+        pd.DataFrame({"transcription": X_test, "department": y_test}).to_csv(holdout_path, index=False)
+        df = df.drop(X_test.index)
+
+    # Refit on every labelled transcript not held out before saving
+    classifier.fit(df[text_column], df[label_column])
+    joblib.dump(classifier, output_path)
+    return classifier
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the fast department classifier used by blaghk.py.")
+    parser.add_argument("csv", help="labelled transcripts, e.g. the df.csv written by New_Model_NN.ipynb")
+    parser.add_argument("-o", "--output", default="department_classifier.joblib")
+    parser.add_argument("--text-column", default="transcription")
+    parser.add_argument("--label-column", default="classes")
+    parser.add_argument("--label-map", help="JSON file mapping the labels of the CSV to the departments of blaghk.py, "
+                                            "by default the notebooks' folder names")
+    parser.add_argument("--holdout-output", help="keep the test split out of the saved model and write it to this CSV")
+    args = parser.parse_args()
+    label_map = FOLDER_DEPARTMENTS
+    if args.label_map:
+        with open(args.label_map, encoding="utf-8") as f:
+            label_map = json.load(f)
+    train(args.csv, args.output, args.text_column, args.label_column, label_map=label_map,
+          holdout_path=args.holdout_output)
+
+
+if __name__ == "__main__":
+    main()
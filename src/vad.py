@@ -0,0 +1,156 @@
+import numpy as np
+
+from audio_ingest import SAMPLE_RATE
+
+FRAME_MS = 30
+
+
+# Function to compute the loudness in dBFS of every full frame of a buffer
+def frame_energy(audio, frame_length):
+    n_frames = len(audio) // frame_length
+    frames = audio[:n_frames * frame_length].reshape(n_frames, frame_length)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1) + 1e-12)
+    return 20 * np.log10(rms)
+
+
+# Function to get the loudness above which a frame is speech: steady line noise sits at the bottom of the
+# loudness distribution and speech stands out above it, however loud the line is
+def speech_threshold(energy, threshold_db=-40.0, margin_db=10.0):
+    noise_floor = np.percentile(energy, 10)
+    return max(threshold_db, noise_floor + margin_db)
+
+
+# Function to turn 16-bit PCM bytes from a recorder into a float32 buffer
+def pcm16_to_float(chunk):
+    return np.frombuffer(chunk, np.int16).astype(np.float32) / 32768.0
+
+
+# Cuts a live stream of audio chunks into speech segments at pauses
+class SpeechSegmenter:
+    def __init__(self, threshold_db=-40.0, margin_db=10.0, min_silence_ms=600, min_speech_ms=250, max_segment_s=25.0,
+                 noise_history_s=10.0, sample_rate=SAMPLE_RATE):
+        self.threshold_db = threshold_db
+        self.margin_db = margin_db
+        self.sample_rate = sample_rate
+        self.frame_length = sample_rate * FRAME_MS // 1000
+        self.min_silence_frames = max(1, min_silence_ms // FRAME_MS)
+        self.min_speech_frames = max(1, min_speech_ms // FRAME_MS)
+        self.max_segment_frames = int(max_segment_s * 1000 // FRAME_MS)
+        # The noise floor is estimated from the loudness of the last few seconds, so it follows the line
+        self.history = np.zeros(0)
+        self.history_frames = int(noise_history_s * 1000 // FRAME_MS)
+        self.pending = np.zeros(0, np.float32)
+        self.frames = []
+        self.speech_frames = 0
+        self.silent_run = 0
+        self.segment_start = 0
+        self.position = 0
+
+    # Function to add a chunk and return the (start, end, audio) segments it completes
+    def feed(self, chunk):
+        if isinstance(chunk, (bytes, bytearray)):
+            chunk = pcm16_to_float(chunk)
+        self.pending = np.concatenate([self.pending, chunk])
+        n_frames = len(self.pending) // self.frame_length
+        if n_frames == 0:
+            return []
+        energy = frame_energy(self.pending, self.frame_length)
+        usable = n_frames * self.frame_length
+        frames = self.pending[:usable].reshape(n_frames, self.frame_length)
+        self.pending = self.pending[usable:]
+        self.history = np.concatenate([self.history, energy])[-self.history_frames:]
+        threshold = speech_threshold(self.history, self.threshold_db, self.margin_db)
+
+        segments = []
+        for frame, loudness in zip(frames, energy):
+            is_speech = loudness > threshold
+            if not self.frames and not is_speech:
+                # Silence between segments is dropped
+                self.position += 1
+                continue
+            if not self.frames:
+                self.segment_start = self.position
+            self.frames.append(frame)
+            self.position += 1
+            if is_speech:
+                self.speech_frames += 1
+                self.silent_run = 0
+            else:
+                self.silent_run += 1
+            if self.silent_run >= self.min_silence_frames or len(self.frames) >= self.max_segment_frames:
+                segment = self.cut()
+                if segment:
+                    segments.append(segment)
+        return segments
+
+    # Function to return the speech left over when the stream ends
+    def flush(self):
+        # Less than a frame of audio can be left over, too short to matter
+        self.pending = np.zeros(0, np.float32)
+        return self.cut()
+
+    def cut(self):
+        frames, speech_frames, silent_run = self.frames, self.speech_frames, self.silent_run
+        self.frames, self.speech_frames, self.silent_run = [], 0, 0
+        if speech_frames < self.min_speech_frames:
+            return None
+        # Trailing silence is not worth transcribing
+        if silent_run and silent_run < len(frames):
+            frames = frames[:-silent_run]
+        start = self.segment_start * self.frame_length / self.sample_rate
+        audio = np.concatenate(frames)
+        return start, start + len(audio) / self.sample_rate, audio
+
+
+# Maps times in a trimmed buffer back to times in the original recording
+class TimeMap:
+    def __init__(self, regions, sample_rate=SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        # (start in trimmed audio, start in original audio, length), all in samples
+        self.pieces = []
+        trimmed_start = 0
+        for start, end in regions:
+            self.pieces.append((trimmed_start, start, end - start))
+            trimmed_start += end - start
+
+    # Function to convert seconds in the trimmed audio to seconds in the original recording
+    def to_original(self, seconds):
+        sample = seconds * self.sample_rate
+        for trimmed_start, original_start, length in self.pieces:
+            if sample <= trimmed_start + length:
+                return (original_start + max(0.0, sample - trimmed_start)) / self.sample_rate
+        if not self.pieces:
+            return seconds
+        trimmed_start, original_start, length = self.pieces[-1]
+        return (original_start + sample - trimmed_start) / self.sample_rate
+
+
+# Function to find the (start, end) samples of speech in a whole recording
+def speech_regions(audio, threshold_db=-40.0, margin_db=10.0, min_silence_ms=300, padding_ms=200,
+                   sample_rate=SAMPLE_RATE):
+    frame_length = sample_rate * FRAME_MS // 1000
+    energy = frame_energy(audio, frame_length)
+    if not len(energy):
+        return []
+    speech = energy > speech_threshold(energy, threshold_db, margin_db)
+
+    # Pad every speech frame so word onsets and endings are kept, which also bridges short pauses
+    padding = max(1, padding_ms // FRAME_MS)
+    gap = max(1, min_silence_ms // FRAME_MS)
+    kernel = np.ones(2 * padding + gap, dtype=np.int32)
+    offset = (len(kernel) - 1) // 2
+    speech = np.convolve(speech.astype(np.int32), kernel)[offset:offset + len(speech)] > 0
+
+    edges = np.diff(np.concatenate([[0], speech.astype(np.int8), [0]]))
+    starts = np.flatnonzero(edges == 1) * frame_length
+    ends = np.minimum(np.flatnonzero(edges == -1) * frame_length, len(audio))
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+# Function to cut silence and line noise out of a recording, keeping a map back to the original times
+def trim_silence(audio, sample_rate=SAMPLE_RATE, **options):
+    regions = speech_regions(audio, sample_rate=sample_rate, **options)
+    if not regions:
+        return audio, TimeMap([(0, len(audio))], sample_rate)
+    trimmed = np.concatenate([audio[start:end] for start, end in regions])
+    return trimmed, TimeMap(regions, sample_rate)
@@ -0,0 +1,106 @@
+import os
+import sys
+import json
+import argparse
+from dataclasses import asdict
+
+import torch
+import whisper
+from safetensors import safe_open
+from safetensors.torch import load_file, save_file
+from transformers import pipeline
+
+# Converted weights are only used when this directory is set, see convert_all below
+WEIGHTS_DIR = os.environ.get("BLAGHK_WEIGHTS_DIR")
+
+
+def whisper_weights_path(size, directory=WEIGHTS_DIR):
+    return os.path.join(directory, f"whisper-{size}.safetensors")
+
+
+def pipeline_weights_path(model_name, directory=WEIGHTS_DIR):
+    return os.path.join(directory, model_name.replace("/", "--"))
+
+
+# Function to get the converted Whisper weights of a size, None if they were not converted
+def find_whisper_weights(size, directory=WEIGHTS_DIR):
+    if not directory or not os.path.exists(whisper_weights_path(size, directory)):
+        return None
+    return whisper_weights_path(size, directory)
+
+
+# Function to get the converted copy of a transformers model if there is one, else the model name itself
+def find_pipeline_weights(model_name, directory=WEIGHTS_DIR):
+    if not directory or not os.path.isdir(pipeline_weights_path(model_name, directory)):
+        return model_name
+    return pipeline_weights_path(model_name, directory)
+
+
+# Function to save a Whisper checkpoint as safetensors, in fp32 so it can be used as it is on a CPU
+def convert_whisper(size, directory):
+    model = whisper.load_model(size, device="cpu")
+    state_dict = {name: tensor.contiguous() for name, tensor in model.state_dict().items()}
+    metadata = {"dims": json.dumps(asdict(model.dims))}
+    # The alignment heads are not part of the state dict, so they are kept with the metadata
+    if size in whisper._ALIGNMENT_HEADS:
+        metadata["alignment_heads"] = whisper._ALIGNMENT_HEADS[size].decode()
+    path = whisper_weights_path(size, directory)
+    save_file(state_dict, path, metadata)
+    return path
+
+
+# Function to build a Whisper model straight on top of memory-mapped weights, without reading or copying them;
+# every process loading the same file shares its pages through the OS page cache
+def load_whisper_mmap(path, device=None):
+    with safe_open(path, framework="pt") as f:
+        metadata = f.metadata()
+    dims = whisper.model.ModelDimensions(**json.loads(metadata["dims"]))
+    # Building the model on the meta device skips allocating and initializing weights that are replaced anyway
+    with torch.device("meta"):
+        model = whisper.model.Whisper(dims)
+    model.load_state_dict(load_file(path), assign=True)
+    # Buffers outside the state dict are left on the meta device and have to be made again
+    model.decoder.mask = torch.empty(dims.n_text_ctx, dims.n_text_ctx).fill_(-float("inf")).triu_(1)
+    all_heads = torch.zeros(dims.n_text_layer, dims.n_text_head, dtype=torch.bool)
+    all_heads[dims.n_text_layer // 2:] = True
+    model.alignment_heads = all_heads.to_sparse()
+    if "alignment_heads" in metadata:
+        model.set_alignment_heads(metadata["alignment_heads"].encode())
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    return model.eval().to(device)
+
+
+# Function to save a transformers pipeline (model, tokenizer or feature extractor) with safetensors weights
+def convert_pipeline(task, model_name, directory):
+    path = pipeline_weights_path(model_name, directory)
+    pipeline(task, model=model_name).save_pretrained(path, safe_serialization=True)
+    return path
+
+
+# Function to convert every model the app loads
+def convert_all(directory, whisper_sizes, pipelines):
+    os.makedirs(directory, exist_ok=True)
+    for size in whisper_sizes:
+        print(f"converting whisper {size}", file=sys.stderr)
+        convert_whisper(size, directory)
+    for task, model_name in pipelines:
+        print(f"converting {model_name}", file=sys.stderr)
+        convert_pipeline(task, model_name, directory)
+
+
+def main():
+    # The model names come from the app, which must not load anything itself
+    os.environ["BLAGHK_PRELOAD"] = "0"
+    from blaghk import EMOTION_MODEL, WHISPER_SIZES, ZERO_SHOT_MODEL
+
+    parser = argparse.ArgumentParser(description="Convert the models to memory-mappable safetensors files.")
+    parser.add_argument("-o", "--output", default=WEIGHTS_DIR or "weights",
+                        help="weights directory, then set BLAGHK_WEIGHTS_DIR to it")
+    parser.add_argument("--whisper-sizes", nargs="+", default=WHISPER_SIZES)
+    args = parser.parse_args()
+    convert_all(args.output, args.whisper_sizes,
+                [("zero-shot-classification", ZERO_SHOT_MODEL), ("audio-classification", EMOTION_MODEL)])
+
+
+if __name__ == "__main__":
+    main()